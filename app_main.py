@@ -1,31 +1,32 @@
-import ast
+from __future__ import annotations
+import asyncio
+import time
+from contextlib import AsyncExitStack, closing
 from datetime import datetime, timedelta
 import azure.functions as func
 import logging
 from connector import Connector
-from latest_tarif import get_latest_tarif
-from latest_tax import get_latest_tax
+from dedup import DEDUP_ENABLED, HashIndex
+from eds_cache import response_cache
+from rate_limit import RetryError, eds_limiter
 from login import login
 from watermark import get_watermark
 from listdates import listdates
 from get_chargeowners_with_charge import load_chargeowners_with_last_charge
 from insert_charges import insert_charge
-from models import Watermark, ChargeOwner, Charge
-from aiohttp import ClientSession
-from insert_tax_tarrifs import insert_tax_and_tarif
-from spotprice import insert_spotprices
-import os
-from dotenv import load_dotenv
-
-
+from backend_writer import BackendWriter, BatchWriter
+from models import Watermark, ChargeOwner, Charge, ChargeownerLatestCharge, ChargeSyncSummary
+from httpx import AsyncClient
+from http_client import get_client
+from scheduler import RUN_TIME_BUDGET, Scheduler, WorkUnit
+from sync_state import SyncStateStore
+from settings import settings
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from jobs import JobProgress
 
-
-load_dotenv()
-
-BASE_URL = os.getenv("BASE_URL")
-if not BASE_URL:
-    raise ValueError("BASEURL environment variable is not set. Please check your .env file.")
+BASE_URL = settings.require_base_url()
 
 print(f"BASE_URL: {BASE_URL}")
 
@@ -34,7 +35,17 @@ INSERT_CHARGE_SW = True
 INSERT_SYSTEM_TARIFF_AND_TAX_SW = True
 INSERT_SPORTPICE_SW = False
 
-app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
+# Send charges, taxes, tarifs and spot prices in batches to the bulk endpoints
+BULK_UPLOAD_SW = settings.bulk_upload
+
+# Number of chargeowners synced in parallel
+CHARGE_SYNC_CONCURRENCY = settings.charge_sync_concurrency
+
+# Skip chargeowners that were checked recently, see sync_state.py
+SYNC_STATE_SW = settings.sync_state
+
+# Chargeowners per scheduled unit, the scheduler can stop between units
+CHARGE_UNIT_SIZE = settings.charge_unit_size
 
 FUTURE_DATE = datetime(9999, 12, 31, 23, 59, 59)
 
@@ -46,8 +57,172 @@ def do_continue(_date: datetime) -> bool:
         return True
     return False
 
-async def data_get_load() -> None:
+def parse_date(value: str | datetime | None) -> datetime | None:
+    """ Dates come from the backend and EDS as ISO strings, None when open ended.
+    """
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+async def sync_chargeowner(connector: Connector, chargeowner: ChargeownerLatestCharge, token,
+                           pricelist: list[dict] | None = None, writer: BackendWriter | BatchWriter | None = None) -> int:
+    """ Bring the charges of a single chargeowner up to date with EDS.
+    `pricelist` is the prefetched price list of the owner, oldest first, without it the owner asks EDS itself.
+    Returns the number of charges inserted.
+    """
+    inserted = 0
+
+    if not chargeowner.valid_from:
+        #Fecting first available charge for the chargeowner
+        if pricelist is not None:
+            charge = connector.first_tariff(pricelist)
+        else:
+            # Raises when EDS could not be asked, None only means EDS has no data for the owner
+            charge = (await connector.async_get_tariffs_bulk([chargeowner], True))[0]
+        if charge is None:
+            logging.info(f"No charges in EDS for {chargeowner.glnnumber} yet, skipping.")
+            return inserted
+        tariff = charge['tariffs']
+        logging.info(f"Got charges for {chargeowner.glnnumber}: {charge}")
+        chargeowner.valid_from = tariff['ValidFrom']
+        chargeowner.valid_to = tariff['ValidTo']
+        chargeowner.is_checked = True
+        logging.info(f"Inserting charge for {chargeowner.glnnumber} with valid from {chargeowner.valid_from} to {chargeowner.valid_to}")
+        await insert_charge(charge, chargeowner, token, writer)
+        inserted += 1
+
+    # Check if newer values are available
+    # If valid_to is FUTURE_DATE, then we need to check if the open period has been followed by a new one
+    # If valid_to is not FUTURE_DATE, then we need to check if there are new charges available from valid_to date
+    _date = parse_date(chargeowner.valid_to) or FUTURE_DATE
+    while do_continue(_date):
+        logging.info(f"Next charge date: {_date}")
+        if _date == FUTURE_DATE and chargeowner.is_checked:
+            logging.info(f"Charge owner {chargeowner.glnnumber} is already checked and valid to future date, skipping.")
+            break
+        elif _date == FUTURE_DATE:
+            logging.info(f"Charge owner {chargeowner.glnnumber} is not checked, checking for new charges.")
+            # Follow the timeline from the start of the open period, it is closed when a newer period was published
+            stored_from = parse_date(chargeowner.valid_from)
+            charges = await connector.async_get_tariff_timeline(chargeowner, chargeowner.chargetypecode,
+                                                                stored_from or datetime.now(), entries=pricelist)
+            charges = [charge for charge in charges if parse_date(charge['tariffs']['ValidFrom']) != stored_from]
+            if not charges:
+                logging.info(f"Charge for {chargeowner.glnnumber} is already valid from {chargeowner.valid_from} to {chargeowner.valid_to}, skipping.")
+                break
+        else:
+            logging.info(f"Charge owner {chargeowner.glnnumber} is less than {_date}, checking for new charges.")
+            # All periods after _date come from one download
+            charges = await connector.async_get_tariff_timeline(chargeowner, chargeowner.chargetypecode, _date,
+                                                                entries=pricelist)
+            if not charges:
+                logging.info(f"No charges found for {chargeowner.glnnumber} on {_date}, skipping.")
+                break
+        for charge in charges:
+            tariff = charge['tariffs']
+            logging.info(f"Inserting charge for {chargeowner.glnnumber} with valid from {tariff['ValidFrom']} to {tariff['ValidTo']}")
+        # The periods are independent writes, let them overlap
+        await asyncio.gather(*(insert_charge(charge, chargeowner, token, writer) for charge in charges))
+        inserted += len(charges)
+        tariff = charges[-1]['tariffs']
+        chargeowner.valid_from = tariff['ValidFrom']
+        chargeowner.valid_to = tariff['ValidTo']
+        chargeowner.is_checked = True
+        if chargeowner.valid_to is None:
+            logging.info(f"Charge owner {chargeowner.glnnumber} has no valid to date, setting to future date.")
+            chargeowner.valid_to = FUTURE_DATE.isoformat()
+        logging.info(f"Charge owner {chargeowner.glnnumber} is fully updated to EDS {chargeowner.valid_to}.")
+        break
+
+    return inserted
+
+async def sync_chargeowners(client: AsyncClient, chargeowners: list[ChargeownerLatestCharge], token,
+                            concurrency: int = CHARGE_SYNC_CONCURRENCY,
+                            writer: BackendWriter | BatchWriter | None = None,
+                            state: SyncStateStore | None = None) -> ChargeSyncSummary:
+    """ Sync the charges of all chargeowners, at most `concurrency` owners at a time.
+    A failing owner is recorded in the summary and does not stop the others.
+    With a sync state store, owners that do not need a probe yet are skipped.
+    """
+    summary = ChargeSyncSummary()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    started = time.monotonic()
+    chargeowners = chargeowners or []
+
+    if state is not None:
+        due = []
+        for chargeowner in chargeowners:
+            if state.should_probe(chargeowner):
+                due.append(chargeowner)
+            else:
+                summary.skipped.append(chargeowner.id)
+        chargeowners = due
+
+    # A malformed chargetype fails its own owner instead of the bulk query of all of them
+    valid = []
+    for chargeowner in chargeowners:
+        try:
+            Connector.chargetypes(chargeowner)
+        except Exception as exc:
+            logging.exception(f"Charge sync failed for {chargeowner.glnnumber}")
+            summary.failed[chargeowner.id] = repr(exc)
+        else:
+            valid.append(chargeowner)
+    chargeowners = valid
+
+    # The price lists of all due owners come from a few bulk queries, each owner resolves its timeline locally
+    pricelists = {}
+    if chargeowners:
+        try:
+            records = await Connector(client).async_get_pricelists_bulk(chargeowners, True)
+        except RetryError:
+            # Each owner asks EDS itself instead
+            logging.exception("Bulk query for the price lists failed")
+        else:
+            pricelists = {id(chargeowner): owner_records for chargeowner, owner_records in zip(chargeowners, records)}
+            # EDS has nothing for these new owners yet, there is nothing to sync
+            no_data = {id(chargeowner) for chargeowner in chargeowners
+                       if not chargeowner.valid_from and not pricelists[id(chargeowner)]}
+            for chargeowner in chargeowners:
+                if id(chargeowner) in no_data:
+                    logging.info(f"No charges in EDS for {chargeowner.glnnumber} yet, skipping.")
+                    summary.skipped.append(chargeowner.id)
+            chargeowners = [chargeowner for chargeowner in chargeowners if id(chargeowner) not in no_data]
+
+    async def _worker(chargeowner: ChargeownerLatestCharge) -> None:
+        async with semaphore:
+            # Each owner gets its own Connector, the tariff state on it is not safe to share
+            connector = Connector(client, chargeowner)
+            try:
+                inserted = await sync_chargeowner(connector, chargeowner, token, pricelists.get(id(chargeowner)), writer)
+                summary.inserted += inserted
+                summary.synced.append(chargeowner.id)
+                if state is not None:
+                    state.record(chargeowner)
+            except Exception as exc:
+                logging.exception(f"Charge sync failed for {chargeowner.glnnumber}")
+                summary.failed[chargeowner.id] = repr(exc)
+
+    await asyncio.gather(*(_worker(chargeowner) for chargeowner in chargeowners))
+    summary.duration = time.monotonic() - started
+    return summary
+
+def merge_charge_summaries(summaries: list[ChargeSyncSummary]) -> ChargeSyncSummary:
+    """Combine the summaries of the charge units of one run."""
+    merged = ChargeSyncSummary()
+    for summary in summaries:
+        merged.synced.extend(summary.synced)
+        merged.skipped.extend(summary.skipped)
+        merged.failed.update(summary.failed)
+        merged.inserted += summary.inserted
+        merged.duration += summary.duration
+    return merged
+
+async def data_get_load(progress: JobProgress | None = None) -> func.HttpResponse:
+    """ Run one sync. In job mode, progress receives the unit timings and the result.
+    """
     logging.info('Python HTTP trigger function processed a request.')
+    invoked = time.monotonic()
 
     # Attempt to log in and retrieve the token
     token = await login()
@@ -69,130 +244,97 @@ async def data_get_load() -> None:
             "Failed to retrieve watermark.",
             status_code=500
         )
-    
-    if INSERT_CHARGE_SW:
-
-        async with ClientSession() as session:
-            connector = Connector(session)
-
-            # Get Chargeowners with thir lates charge and see # if they have valid_from and valid_to dates
-            chargeowners_with_latest_charges = await load_chargeowners_with_last_charge(token)
-
-            for chargeowner in chargeowners_with_latest_charges:
-                if not chargeowner.valid_from:
-                    #Fecting first available charge for the chargeowner
-                    charge = await connector.async_get_tariffs(chargeowner, chargeowner.chargetypecode,True)
-                    tariff = charge['tariffs']
-                    logging.info(f"Got charges for {chargeowner.glnnumber}: {charge}")
-                    chargeowner.valid_from = tariff['ValidFrom']
-                    chargeowner.valid_to = tariff['ValidTo']
-                    chargeowner.is_checked = True
-                    logging.info(f"Inserting charge for {chargeowner.glnnumber} with valid from {chargeowner.valid_from} to {chargeowner.valid_to}")
-                    await insert_charge(charge, chargeowner, token)
-                
-
-            # Iterate over chargeowners with their latest charges and check if newer values are available
-            # If valid_to is FUTURE_DATE, then we need to check if there are new charges available
-            # If valid_to is not FUTURE_DATE, then we need to check if there are new charges available from valid_to date
-            for chargeowner in chargeowners_with_latest_charges:
-
-                _date = datetime.fromisoformat(chargeowner.valid_to)
-                while do_continue(_date):
-                    logging.info(f"Next charge date: {_date}")
-                    if chargeowner.valid_to == FUTURE_DATE and chargeowner.is_checked:
-                        logging.info(f"Charge owner {chargeowner.glnnumber} is already checked and valid to future date, skipping.")
-                        break
-                    elif chargeowner.valid_to == FUTURE_DATE and not chargeowner.is_checked:
-                        logging.info(f"Charge owner {chargeowner.glnnumber} is not checked, checking for new charges.")
-                        date_str = _date.strftime("%Y-%m-%d")
-                        charge = await connector.async_get_tariffs(chargeowner, chargeowner.chargetypecode,False, date_str)
-                        tariff = charge['tariffs']
-                        if tariff['ValidFrom'] != chargeowner.valid_from:
-                            chargeowner.valid_from = tariff['ValidFrom']
-                            chargeowner.valid_to = tariff['ValidTo']
-                            chargeowner.is_checked = True
-                            logging.info(f"Inserting charge for {chargeowner.glnnumber} with valid from {chargeowner.valid_from} to {chargeowner.valid_to}")
-                            await insert_charge(charge, chargeowner, token)
-                            if chargeowner.valid_to is not None:
-                                _date = datetime.fromisoformat(chargeowner.valid_to)
-                        else:
-                            logging.info(f"Charge for {chargeowner.glnnumber} is already valid from {chargeowner.valid_from} to {chargeowner.valid_to}, skipping.")
-                            break
-                    else:
-                        logging.info(f"Charge owner {chargeowner.glnnumber} is less than {_date}, checking for new charges.")
-                        charge = await connector.async_get_tariffs(chargeowner, chargeowner.chargetypecode,False, _date)
-                        tariff = charge['tariffs']
-                        if not tariff:
-                            logging.info(f"No charges found for {chargeowner.glnnumber} on {_date}, skipping.")
-                            break
-                        chargeowner.valid_from = tariff['ValidFrom']
-                        chargeowner.valid_to = tariff['ValidTo']
-                        chargeowner.is_checked = True
-                        logging.info(f"Inserting charge for {chargeowner.glnnumber} with valid from {chargeowner.valid_from} to {chargeowner.valid_to}")
-                        await insert_charge(charge, chargeowner, token)
-                        if chargeowner.valid_to is None:
-                            logging.info(f"Charge owner {chargeowner.glnnumber} has no valid to date, setting to future date.")
-                            chargeowner.valid_to = FUTURE_DATE.isoformat()
-                        if _date == datetime.fromisoformat(chargeowner.valid_to):
-                            logging.info(f"Charge owner {chargeowner.glnnumber} is fully updated to EDS {_date}, skipping.")
-                            break
-                        _date = datetime.fromisoformat(chargeowner.valid_to)
-                        
-                        
-
-
-
-
-    if INSERT_SYSTEM_TARIFF_AND_TAX_SW:
-        latest_tarif_valid_to, latest_tax_valid_to, qdate, is_default = await get_latest_date(token)
-
-        first_default = is_default
-
-        while qdate < datetime.now():
-            async with ClientSession() as session:
-                logging.info(f"Latest tarif is valid until {latest_tarif_valid_to}")
-                logging.info(f"Latest tax is valid until {latest_tax_valid_to}")
-                logging.info(f"inserting system tariff and tax.")
-                connector = Connector(session)
-                await insert_tax_and_tarif(token, latest_tarif_valid_to, connector)
-                logging.info(f"System tariff and tax inserted successfully.")
-                latest_tarif_valid_to, latest_tax_valid_to, qdate, is_default = await get_latest_date(token)
-                if first_default and is_default:
-                    logging.info(f"Default date used for tarif and tax: {qdate}")
-                    break
-
-
-    if INSERT_SPORTPICE_SW:
-        spotprices_date = listdates(watermark.spotprices_max_date)
-        for _date in spotprices_date:
-            logging.info(f"Next spot price date: {_date}")
-            await insert_spotprices(_date, token)
-        
-                
-    return func.HttpResponse(f"Token: {watermark}, This HTTP triggered function executed successfully.")
-
-async def get_latest_date(token):
-    latest_tarif_db = await get_latest_tarif(token)
-    latest_tax_db = await get_latest_tax(token)
+    if progress is not None:
+        progress.stage("prepare", "done", time.monotonic() - invoked)
 
-        # Convert valid_to to datetime if it's a string
-    latest_tarif_valid_to = latest_tarif_db.valid_to
-    latest_tax_valid_to = latest_tax_db.valid_to
+    # One pooled writer is shared by all stages
+    async with AsyncExitStack() as stack:
+        scheduler = stack.enter_context(closing(Scheduler(budget=RUN_TIME_BUDGET - (time.monotonic() - invoked))))
+        dedup = stack.enter_context(closing(HashIndex())) if DEDUP_ENABLED else None
+        writer = await stack.enter_async_context(BackendWriter(token, dedup=dedup))
+        if BULK_UPLOAD_SW:
+            writer = await stack.enter_async_context(BatchWriter(writer))
 
-    if isinstance(latest_tarif_valid_to, str):
-        latest_tarif_valid_to = datetime.fromisoformat(latest_tarif_valid_to)
-    if isinstance(latest_tax_valid_to, str):
-        latest_tax_valid_to = datetime.fromisoformat(latest_tax_valid_to)
+        # The stages are split in units the scheduler fits into the time budget
+        units = []
+        if INSERT_CHARGE_SW:
 
-    qdate = min(latest_tarif_valid_to, latest_tax_valid_to)
-    is_default = False
-
-    if qdate == datetime(9999, 12, 31, 23, 59, 59):
-        qdate = datetime.now() - timedelta(days=1)
-        is_default = True
-    return latest_tarif_valid_to,latest_tax_valid_to,qdate,is_default
+            # Get Chargeowners with thir lates charge and see # if they have valid_from and valid_to dates
+            chargeowners_with_latest_charges = await load_chargeowners_with_last_charge(token) or []
+
+            # Owners that are not due are skipped, and counted, by sync_chargeowners
+            state = stack.enter_context(closing(SyncStateStore())) if SYNC_STATE_SW else None
+            for start in range(0, len(chargeowners_with_latest_charges), CHARGE_UNIT_SIZE):
+                chunk = chargeowners_with_latest_charges[start:start + CHARGE_UNIT_SIZE]
+                units.append(WorkUnit(
+                    name=f"charges:{start // CHARGE_UNIT_SIZE}",
+                    kind="charges",
+                    run=lambda chunk=chunk: sync_chargeowners(get_client(), chunk, token, writer=writer, state=state),
+                    priority=0,
+                    size=len(chunk),
+                ))
+
+        # The modules of the later stages are only imported when the stage runs
+        if INSERT_SYSTEM_TARIFF_AND_TAX_SW:
+            from insert_tax_tarrifs import sync_system_tariffs
+            units.append(WorkUnit(
+                name="system_tariffs",
+                kind="system_tariffs",
+                run=lambda: sync_system_tariffs(token, Connector(get_client()), writer),
+                priority=1,
+            ))
+
+        if INSERT_SPORTPICE_SW:
+            # The missing days are fetched concurrently, so they are one unit
+            spotprice_dates = listdates(watermark.spotprices_max_date)
+            if spotprice_dates:
+                from spotprice import insert_spotprices_range
+                units.append(WorkUnit(
+                    name="spotprices",
+                    kind="spotprices",
+                    run=lambda: insert_spotprices_range(spotprice_dates, token, writer),
+                    priority=2,
+                    size=len(spotprice_dates),
+                    stale_since=datetime.combine(spotprice_dates[0], datetime.min.time()),
+                ))
+
+        report = await scheduler.run(units, progress.stage if progress is not None else None)
+
+    charge_summaries = [result for result in report.results.values() if isinstance(result, ChargeSyncSummary)]
+    if charge_summaries:
+        summary = merge_charge_summaries(charge_summaries)
+        logging.info(
+            f"Charge sync finished: {len(summary.synced)} synced, {len(summary.skipped)} skipped, {len(summary.failed)} failed, "
+            f"{summary.inserted} charges inserted in {summary.duration:.1f}s"
+        )
+        for owner_id, error in summary.failed.items():
+            logging.error(f"Charge sync failed for chargeowner {owner_id}: {error}")
+    if "system_tariffs" in report.results:
+        taxes, tarifs = report.results["system_tariffs"]
+        logging.info(f"System tariff and tax inserted successfully: {taxes} taxes, {tarifs} tarifs.")
+
+    logging.info(
+        f"Run finished in {report.duration:.1f}s: {len(report.completed)} units done, "
+        f"{len(report.failed)} failed, {len(report.backlog)} left for the next run"
+    )
+    for name, error in report.failed.items():
+        logging.error(f"{name} failed: {error}")
+    if report.backlog:
+        logging.info(f"Backlog: {', '.join(report.backlog)}")
+    logging.info(f"Backend writes: {writer.summary()}")
+    logging.info(f"EDS response cache: {response_cache.stats()}")
+    logging.info(f"EDS rate limiter: {eds_limiter.stats()}")
+
+    if progress is not None:
+        progress.result({
+            "completed": report.completed,
+            "failed": report.failed,
+            "backlog": report.backlog,
+            "duration": round(report.duration, 3),
+            "writes": writer.summary(),
+        })
 
-import asyncio
+    return func.HttpResponse(f"Token: {watermark}, This HTTP triggered function executed successfully.")
 
 if __name__ == "__main__":
     asyncio.run(data_get_load())
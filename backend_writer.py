@@ -0,0 +1,291 @@
+import asyncio
+from dataclasses import dataclass
+import gzip
+import json
+import logging
+import time
+import zlib
+
+import httpx
+from dedup import HashIndex, payload_hash
+from http_client import get_client
+from login import token_provider
+from settings import settings
+
+_logger = logging.getLogger(__name__)
+
+BASE_URL = settings.require_base_url()
+
+# Number of writes allowed in flight at the same time
+MAX_IN_FLIGHT = settings.backend_max_in_flight
+
+# Batches are flushed when they reach BATCH_SIZE items or are BATCH_FLUSH_INTERVAL seconds old
+BATCH_SIZE = settings.backend_batch_size
+BATCH_FLUSH_INTERVAL = settings.backend_batch_flush_interval
+
+# Request bodies of at least BACKEND_COMPRESSION_MIN_BYTES are sent gzip or deflate
+# compressed when BACKEND_COMPRESSION is set, see bench_compression.py for the gain
+BACKEND_COMPRESSION = settings.backend_compression
+BACKEND_COMPRESSION_MIN_BYTES = settings.backend_compression_min_bytes
+BACKEND_COMPRESSION_LEVEL = settings.backend_compression_level
+
+
+def encode_body(payload) -> bytes:
+    """Serialize the payload the way httpx does for json=."""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode("utf-8")
+
+
+def compress_body(body: bytes, compression: str, min_bytes: int = BACKEND_COMPRESSION_MIN_BYTES,
+                  level: int = BACKEND_COMPRESSION_LEVEL) -> tuple[bytes, dict]:
+    """Compress the body when it is large enough, returns it with the headers it needs."""
+    if len(body) < min_bytes:
+        return body, {}
+    if compression == "gzip":
+        return gzip.compress(body, compresslevel=level, mtime=0), {"Content-Encoding": "gzip"}
+    if compression == "deflate":
+        return zlib.compress(body, level), {"Content-Encoding": "deflate"}
+    return body, {}
+
+
+@dataclass
+class WriteResult:
+    path: str
+    status_code: int
+    latency: float
+    text: str = ""
+    skipped: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status_code < 300
+
+
+class BackendWriter:
+    """Async writer for the HEADS backend on the shared pooled keep-alive client."""
+
+    def __init__(self, token: str, client: httpx.AsyncClient | None = None, max_in_flight: int = MAX_IN_FLIGHT,
+                 dedup: HashIndex | None = None, compression: str = BACKEND_COMPRESSION) -> None:
+        self.token = token
+        self._client = client
+        self.dedup = dedup
+        self.compression = compression
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        # Paths without a bulk endpoint, shared by every BatchWriter on this writer
+        self.bulk_unsupported: set[str] = set()
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.count = 0
+        self.failed = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    async def __aenter__(self) -> "BackendWriter":
+        if self._client is None:
+            self._client = get_client()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        # The client is shared, its connections stay open for the next run
+        await self.flush()
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.token}",
+            "Content-Type": "application/json"
+        }
+
+    async def _send(self, path: str, payload) -> httpx.Response:
+        raw = encode_body(payload)
+        body, extra_headers = compress_body(raw, self.compression)
+        response = await self._client.post(f"{BASE_URL}{path}", headers={**self._headers(), **extra_headers}, content=body)
+        if response.status_code == 415 and extra_headers:
+            # The backend does not take compressed bodies, send plain JSON from now on
+            if self.compression != "none":
+                _logger.warning(f"Backend refused {extra_headers['Content-Encoding']} request bodies, sending them uncompressed.")
+                self.compression = "none"
+            body = raw
+            response = await self._client.post(f"{BASE_URL}{path}", headers=self._headers(), content=body)
+        self.bytes_raw += len(raw)
+        self.bytes_sent += len(body)
+        return response
+
+    async def post(self, path: str, payload, expected_status: tuple[int, ...] = ()) -> WriteResult:
+        """POST the payload to path and record the latency of the call.
+
+        Statuses in expected_status are an answer the caller handles, not a failed write.
+        """
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self._send(path, payload)
+                if response.status_code == 401:
+                    # The token expired during the run, log in again once and resend
+                    token = await token_provider.refresh(self.token)
+                    if token and token != self.token:
+                        self.token = token
+                        response = await self._send(path, payload)
+                result = WriteResult(path, response.status_code, time.perf_counter() - started, response.text)
+            except httpx.HTTPError as exc:
+                _logger.error(f"Request to {path} failed: {exc}")
+                result = WriteResult(path, 0, time.perf_counter() - started, str(exc))
+
+        self.count += 1
+        self.total_latency += result.latency
+        self.max_latency = max(self.max_latency, result.latency)
+        if not result.ok and result.status_code not in expected_status:
+            self.failed += 1
+        _logger.debug(f"POST {path} returned {result.status_code} in {result.latency * 1000:.0f} ms")
+        return result
+
+    async def flush(self) -> None:
+        """Writes are sent right away, there is nothing to flush."""
+
+    def summary(self) -> str:
+        average = self.total_latency / self.count if self.count else 0.0
+        summary = (f"{self.count} writes, {self.failed} failed, "
+                   f"avg {average * 1000:.0f} ms, max {self.max_latency * 1000:.0f} ms")
+        if self.dedup is not None:
+            summary += f", {self.dedup.skipped} unchanged skipped"
+        if self.bytes_sent != self.bytes_raw:
+            summary += f", {self.bytes_sent / 1024:.0f} of {self.bytes_raw / 1024:.0f} kB sent compressed"
+        return summary
+
+
+class BatchWriter:
+    """Collects payloads per path and sends them in chunks to the `<path>/bulk` endpoints.
+
+    A batch is flushed when it reaches batch_size items or is flush_interval seconds old.
+    Paths without a bulk endpoint, and batches the backend rejects as a whole, fall back
+    to one POST per item so a bad item only fails itself.
+    """
+
+    def __init__(self, writer: BackendWriter, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = BATCH_FLUSH_INTERVAL) -> None:
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: dict[str, list[tuple[dict, asyncio.Future]]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._timer: asyncio.Task | None = None
+        self.sent = 0
+        self.failures: list[tuple[str, dict, str]] = []
+
+    @property
+    def dedup(self) -> HashIndex | None:
+        return self.writer.dedup
+
+    async def __aenter__(self) -> "BatchWriter":
+        self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+
+    def add(self, path: str, payload: dict) -> asyncio.Future:
+        """Queue the payload for path, the future resolves to its WriteResult once sent."""
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(path, [])
+        batch.append((payload, future))
+        if len(batch) >= self.batch_size:
+            self._start_send(path)
+        return future
+
+    async def flush(self) -> None:
+        """Send everything queued and wait for all batches in flight."""
+        for path in list(self._pending):
+            self._start_send(path)
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    def _start_send(self, path: str) -> None:
+        batch = self._pending.pop(path, [])
+        if not batch:
+            return
+        task = asyncio.create_task(self._send(path, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            for path in list(self._pending):
+                self._start_send(path)
+
+    async def _send(self, path: str, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        if path not in self.writer.bulk_unsupported:
+            result = await self.writer.post(f"{path}/bulk", [payload for payload, _ in batch], expected_status=(404, 405))
+            if result.status_code in (404, 405):
+                if path not in self.writer.bulk_unsupported:
+                    _logger.info(f"No bulk endpoint for {path}, sending items one by one.")
+                self.writer.bulk_unsupported.add(path)
+            elif result.ok:
+                self._resolve_bulk(path, batch, result)
+                return
+            else:
+                _logger.warning(f"Bulk upload to {path} failed with {result.status_code}, retrying items one by one.")
+
+        results = await asyncio.gather(*(self.writer.post(path, payload) for payload, _ in batch))
+        for (payload, future), result in zip(batch, results):
+            self._resolve(path, payload, future, result)
+
+    def _resolve_bulk(self, path: str, batch: list[tuple[dict, asyncio.Future]], result: WriteResult) -> None:
+        """Resolve the items of a bulk call from the per item results in the response."""
+        try:
+            items = json.loads(result.text).get("results") or []
+        except (ValueError, AttributeError):
+            items = []
+
+        for index, (payload, future) in enumerate(batch):
+            item = items[index] if index < len(items) else {}
+            if item.get("ok", True):
+                item_result = WriteResult(path, result.status_code, result.latency)
+            else:
+                item_result = WriteResult(path, item.get("status_code", 422), result.latency, str(item.get("error", "")))
+            self._resolve(path, payload, future, item_result)
+
+    def _resolve(self, path: str, payload: dict, future: asyncio.Future, result: WriteResult) -> None:
+        if result.ok:
+            self.sent += 1
+        else:
+            _logger.error(f"Failed to write to {path}: {result.status_code} - {result.text}")
+            self.failures.append((path, payload, result.text))
+        if not future.done():
+            future.set_result(result)
+
+    def summary(self) -> str:
+        return f"{self.sent} items sent, {len(self.failures)} failed; {self.writer.summary()}"
+
+
+async def post(path: str, payload, token: str, writer: BackendWriter | BatchWriter | None = None) -> WriteResult | None:
+    """POST through the given writer, or a short lived one when there is none.
+
+    A BatchWriter only queues the payload, None is returned in that case. When the
+    writer has a hash index, a payload already written unchanged is not sent again
+    and a skipped result is returned.
+    """
+    dedup = writer.dedup if writer is not None else None
+    key = None
+    if dedup is not None:
+        key = payload_hash(payload)
+        if dedup.seen(path, key):
+            dedup.skipped += 1
+            return WriteResult(path, 200, 0.0, "unchanged", skipped=True)
+
+    if isinstance(writer, BatchWriter):
+        future = writer.add(path, payload)
+        if key is not None:
+            def _remember(done: asyncio.Future) -> None:
+                if not done.cancelled() and done.result().ok:
+                    dedup.add(path, key)
+            future.add_done_callback(_remember)
+        return None
+    if writer is not None:
+        result = await writer.post(path, payload)
+        if key is not None and result.ok:
+            dedup.add(path, key)
+        return result
+    async with BackendWriter(token) as writer:
+        return await writer.post(path, payload)
@@ -0,0 +1,252 @@
+"""
+Historical backfill of charges, taxes/tarifs and spot prices for a date range.
+
+The range is split in partitions of BACKFILL_PARTITION_DAYS days that are loaded
+concurrently. Every finished partition is recorded in a SQLite checkpoint, so an
+interrupted or timed out run picks up at the first unfinished partition when it
+is started again with the same range.
+
+    python backfill.py 2020-01-01 2025-01-01 --kinds charges tax_tarif
+"""
+import argparse
+import asyncio
+from contextlib import AsyncExitStack, closing
+from datetime import datetime, timedelta
+import logging
+import time
+
+from backend_writer import BackendWriter, BatchWriter
+from connector import Connector
+from dedup import DEDUP_ENABLED, HashIndex
+from get_chargeowners_with_charge import load_chargeowners_with_last_charge
+from http_client import get_client
+from insert_charges import insert_charge
+from insert_tax_tarrifs import insert_tarif, insert_tax, system_tariff_indexes, tarif_at, tax_from_tariff
+from interval_index import IntervalIndex
+from login import login
+from models import BackfillSummary, ChargeownerLatestCharge
+from spotprice import fetch_spotprices, upload_day
+from settings import connect_state_db, settings
+
+_logger = logging.getLogger(__name__)
+
+BACKFILL_CHECKPOINT = settings.backfill_checkpoint
+BACKFILL_PARTITION_DAYS = settings.backfill_partition_days
+BACKFILL_CONCURRENCY = settings.backfill_concurrency
+
+KINDS = ("charges", "tax_tarif", "spotprices")
+
+
+def partitions(start: datetime, end: datetime, days: int = BACKFILL_PARTITION_DAYS) -> list[tuple[datetime, datetime]]:
+    """Split [start, end) in consecutive ranges of at most days days."""
+    ranges = []
+    while start < end:
+        stop = min(start + timedelta(days=max(1, days)), end)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+class Checkpoint:
+    """Finished partitions per kind, kept in a SQLite file."""
+
+    def __init__(self, path: str = BACKFILL_CHECKPOINT) -> None:
+        self._db = connect_state_db(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS partition ("
+            " kind TEXT NOT NULL, start TEXT NOT NULL, stop TEXT NOT NULL,"
+            " status TEXT NOT NULL, inserted INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT, updated_at TEXT NOT NULL,"
+            " PRIMARY KEY (kind, start, stop))"
+        )
+        self._db.commit()
+
+    def is_done(self, kind: str, start: datetime, stop: datetime) -> bool:
+        row = self._db.execute(
+            "SELECT status FROM partition WHERE kind = ? AND start = ? AND stop = ?",
+            (kind, start.isoformat(), stop.isoformat()),
+        ).fetchone()
+        return row is not None and row[0] == "done"
+
+    def record(self, kind: str, start: datetime, stop: datetime, status: str,
+               inserted: int = 0, error: str | None = None) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO partition (kind, start, stop, status, inserted, error, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (kind, start.isoformat(), stop.isoformat(), status, inserted, error, datetime.now().isoformat()),
+        )
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def period_starts(indexes: list[IntervalIndex], start: datetime, stop: datetime, first: bool) -> list[datetime]:
+    """The dates in [start, stop) where a new period begins in any of the indexes.
+
+    The first partition also includes start itself, for the period already running then.
+    """
+    starts = {start} if first else set()
+    for index in indexes:
+        for entry in index.overlapping(start, stop):
+            valid_from = datetime.fromisoformat(entry["ValidFrom"])
+            if start <= valid_from < stop:
+                starts.add(valid_from)
+    return sorted(starts)
+
+
+class Backfill:
+    """Loads the history of the selected kinds, one partition at a time per task."""
+
+    def __init__(self, token, writer: BackendWriter, connector: Connector, checkpoint: Checkpoint,
+                 start: datetime, concurrency: int = BACKFILL_CONCURRENCY) -> None:
+        self.token = token
+        self.writer = writer
+        self.connector = connector
+        self.checkpoint = checkpoint
+        self.start = start
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._chargeowners: list[ChargeownerLatestCharge] | None = None
+        self._pricelists: dict[int, asyncio.Task] = {}
+        self._system_tariffs: asyncio.Task | None = None
+
+    async def run_partition(self, kind: str, start: datetime, stop: datetime, summary: BackfillSummary) -> None:
+        name = f"{kind} {start.date()}..{stop.date()}"
+        if self.checkpoint.is_done(kind, start, stop):
+            summary.skipped.append(name)
+            return
+
+        async with self._semaphore:
+            try:
+                # A batch per partition, so its failures are known before it is checkpointed
+                async with BatchWriter(self.writer) as batch:
+                    inserted = await getattr(self, f"_load_{kind}")(start, stop, batch)
+                if batch.failures:
+                    raise RuntimeError(f"{len(batch.failures)} writes failed")
+            except Exception as exc:
+                _logger.exception(f"Backfill of {name} failed")
+                self.checkpoint.record(kind, start, stop, "failed", error=repr(exc))
+                summary.failed[name] = repr(exc)
+                return
+
+        self.checkpoint.record(kind, start, stop, "done", inserted)
+        summary.done.append(name)
+        summary.inserted += inserted
+        _logger.info(f"Backfilled {name}: {inserted} items")
+
+    async def _load_charges(self, start: datetime, stop: datetime, batch: BatchWriter) -> int:
+        if self._chargeowners is None:
+            self._chargeowners = await load_chargeowners_with_last_charge(self.token) or []
+
+        inserted = 0
+        for chargeowner in self._chargeowners:
+            index = await self._pricelist(chargeowner)
+            for date in period_starts([index], start, stop, start == self.start):
+                tariff = self.connector.select_indexed(index, date)
+                if tariff:
+                    await insert_charge({"tariffs": tariff}, chargeowner, self.token, batch)
+                    inserted += 1
+        return inserted
+
+    async def _load_tax_tarif(self, start: datetime, stop: datetime, batch: BatchWriter) -> int:
+        elafgift, systemtarif, nettarif = await self._system_tariff_indexes()
+        first = start == self.start
+
+        inserted = 0
+        for date in period_starts([elafgift], start, stop, first):
+            tariff = self.connector.select_indexed(elafgift, date)
+            if tariff:
+                await insert_tax(self.token, tax_from_tariff(tariff), batch)
+                inserted += 1
+        for date in period_starts([systemtarif, nettarif], start, stop, first):
+            tarif = tarif_at(self.connector, systemtarif, nettarif, date)
+            if tarif is not None:
+                await insert_tarif(self.token, tarif, batch)
+                inserted += 1
+        return inserted
+
+    async def _load_spotprices(self, start: datetime, stop: datetime, batch: BatchWriter) -> int:
+        dates = [(start + timedelta(days=day)).date() for day in range((stop - start).days)]
+        days = await fetch_spotprices(dates)
+        missing = [str(spotdate) for spotdate in dates if spotdate not in days]
+        if missing:
+            raise RuntimeError(f"No valid spot prices for {', '.join(missing)}")
+        for spotdate in dates:
+            await upload_day(self.token, days[spotdate], batch)
+        return len(days)
+
+    async def _pricelist(self, chargeowner: ChargeownerLatestCharge) -> IntervalIndex:
+        """The price list of a chargeowner, downloaded once for all partitions."""
+        task = self._pricelists.get(chargeowner.id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_pricelist(chargeowner))
+            self._pricelists[chargeowner.id] = task
+        return await task
+
+    async def _load_pricelist(self, chargeowner: ChargeownerLatestCharge) -> IntervalIndex:
+        entries = await self.connector.async_get_pricelist(chargeowner, chargeowner.chargetypecode)
+        return IntervalIndex(entries)
+
+    async def _system_tariff_indexes(self) -> tuple[IntervalIndex, IntervalIndex, IntervalIndex]:
+        if self._system_tariffs is None:
+            self._system_tariffs = asyncio.ensure_future(self.connector.async_get_system_tariff_entries())
+        entries = await self._system_tariffs
+        if not entries:
+            raise RuntimeError("Could not fetch system tariffs from Energi Data Service DataHub")
+        return system_tariff_indexes(entries)
+
+
+async def backfill(start: datetime, end: datetime, kinds: tuple[str, ...] = KINDS,
+                   partition_days: int = BACKFILL_PARTITION_DAYS, concurrency: int = BACKFILL_CONCURRENCY,
+                   checkpoint_path: str = BACKFILL_CHECKPOINT) -> BackfillSummary:
+    """Load the history of kinds for [start, end), resuming from the checkpoint."""
+    summary = BackfillSummary()
+    started = time.monotonic()
+
+    token = await login()
+    if not token:
+        raise RuntimeError("Login failed. Please check your credentials.")
+
+    checkpoint = Checkpoint(checkpoint_path)
+    try:
+        async with AsyncExitStack() as stack:
+            dedup = stack.enter_context(closing(HashIndex())) if DEDUP_ENABLED else None
+            writer = await stack.enter_async_context(BackendWriter(token, dedup=dedup))
+            job = Backfill(token, writer, Connector(get_client()), checkpoint, start, concurrency)
+            await asyncio.gather(*(
+                job.run_partition(kind, partition_start, partition_stop, summary)
+                for kind in kinds
+                for partition_start, partition_stop in partitions(start, end, partition_days)
+            ))
+    finally:
+        checkpoint.close()
+
+    summary.duration = time.monotonic() - started
+    logging.info(
+        f"Backfill finished: {len(summary.done)} partitions loaded, {len(summary.skipped)} already done, "
+        f"{len(summary.failed)} failed, {summary.inserted} items in {summary.duration:.1f}s"
+    )
+    logging.info(f"Backend writes: {writer.summary()}")
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill the HEADS backend for a date range.")
+    parser.add_argument("start", type=datetime.fromisoformat, help="first day, e.g. 2020-01-01")
+    parser.add_argument("end", type=datetime.fromisoformat, help="day after the last day")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--partition-days", type=int, default=BACKFILL_PARTITION_DAYS)
+    parser.add_argument("--concurrency", type=int, default=BACKFILL_CONCURRENCY)
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    summary = asyncio.run(backfill(
+        args.start, args.end, tuple(args.kinds), args.partition_days, args.concurrency, args.checkpoint
+    ))
+    for name, error in summary.failed.items():
+        logging.error(f"Backfill of {name} failed: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Memory benchmark of holding charge history in memory.
+
+Compares the plain dataclass with 24 float attributes that models.Charge used to be,
+and the tariff dicts the charges are built from, with the slotted array-backed Charge.
+Run with `python bench_charge_memory.py`.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import random
+import tracemalloc
+
+from models import Charge
+
+CHARGES = 20000
+
+
+@dataclass
+class LegacyCharge:
+    chargeowner_id: int
+    charge_type: str
+    charge_type_code: str
+    note: str
+    description: str
+    valid_from: datetime
+    valid_to: datetime
+    price1: float
+    price2: float
+    price3: float
+    price4: float
+    price5: float
+    price6: float
+    price7: float
+    price8: float
+    price9: float
+    price10: float
+    price11: float
+    price12: float
+    price13: float
+    price14: float
+    price15: float
+    price16: float
+    price17: float
+    price18: float
+    price19: float
+    price20: float
+    price21: float
+    price22: float
+    price23: float
+    price24: float
+
+
+def make_prices() -> list[list[float]]:
+    return [[random.uniform(0.05, 1.2) for _ in range(24)] for _ in range(CHARGES)]
+
+
+def build_tariff_dicts(prices):
+    start = datetime(2015, 1, 1)
+    return [
+        {
+            **{f"price{hour}": price for hour, price in enumerate(day)},
+            "ValidFrom": (start + timedelta(days=i)).isoformat(), "ValidTo": None,
+            "Note": "Nettarif C", "Description": "Nettarif C", "ChargeType": "D03", "ChargeTypeCode": "DT_C_01",
+        }
+        for i, day in enumerate(prices)
+    ]
+
+
+def build_legacy(prices):
+    start = datetime(2015, 1, 1)
+    return [
+        LegacyCharge(i % 300, "D03", "DT_C_01", "Nettarif C", "Nettarif C",
+                     start + timedelta(days=i), start + timedelta(days=i + 1),
+                     **{f"price{hour + 1}": price for hour, price in enumerate(day)})
+        for i, day in enumerate(prices)
+    ]
+
+
+def build_compact(prices):
+    start = datetime(2015, 1, 1)
+    return [
+        Charge(i % 300, "D03", "DT_C_01", "Nettarif C", "Nettarif C",
+               start + timedelta(days=i), start + timedelta(days=i + 1), day)
+        for i, day in enumerate(prices)
+    ]
+
+
+def measure(build, prices) -> int:
+    # Copy the floats so every variant pays for its own price objects
+    prices = [[float(str(price)) for price in day] for day in prices]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = build(prices)
+    del prices
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del objects
+    return size
+
+
+def main() -> None:
+    prices = make_prices()
+    print(f"{CHARGES} charges")
+    baseline = None
+    for name, build in (("tariff dicts", build_tariff_dicts), ("legacy dataclass", build_legacy),
+                        ("slotted + array", build_compact)):
+        size = measure(build, prices)
+        baseline = baseline or size
+        print(f"{name:>17}: {size / 1024 / 1024:7.2f} MiB  {size / CHARGES:6.0f} B/charge  {baseline / size:4.1f}x")
+
+
+if __name__ == "__main__":
+    main()
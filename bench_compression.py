@@ -0,0 +1,92 @@
+"""
+Benchmark of gzip/deflate request bodies for the backend writes.
+
+Builds realistic bulk payloads and reports the bytes on the wire, the time spent
+compressing and the upload time saved at a given uplink bandwidth. Run with
+`python bench_compression.py [bandwidth in Mbit/s]`, 10 by default.
+
+BASE_URL only has to be set for the imports, nothing is sent.
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("BASE_URL", "http://localhost")
+
+from backend_writer import compress_body, encode_body
+from bench_decoder import make_records
+from models import Charge, SpotPriceSeries, Tarif, Tax
+from pricelist_decoder import DATAHUB_PRICELIST_DECODER
+
+REPEAT = 5
+
+
+def charge_payloads(count: int) -> list[dict]:
+    payloads = []
+    for record in make_records(count):
+        tariff = DATAHUB_PRICELIST_DECODER.decode_tariff(record)
+        charge = Charge(
+            chargeowner_id=random.randint(1, 80),
+            charge_type=tariff["ChargeType"],
+            charge_type_code=tariff["ChargeTypeCode"],
+            note=tariff["Note"],
+            description=tariff["Description"],
+            valid_from=datetime.fromisoformat(tariff["ValidFrom"]),
+            valid_to=datetime(9999, 12, 31, 23, 59, 59),
+            prices=[tariff[f"price{hour}"] for hour in range(24)],
+        )
+        payloads.append(charge.to_payload())
+    return payloads
+
+
+def tax_tarif_payloads(count: int) -> list[dict]:
+    start = datetime(2020, 1, 1)
+    payloads = []
+    for i in range(count):
+        valid_from, valid_to = start + timedelta(days=90 * i), start + timedelta(days=90 * (i + 1))
+        tax = Tax(valid_from, valid_to, round(random.uniform(0.008, 0.9), 4), False)
+        tarif = Tarif(valid_from, valid_to, round(random.uniform(0.04, 0.1), 4), round(random.uniform(0.05, 0.1), 4), False)
+        for item in (tax, tarif):
+            payloads.append({key: value.isoformat() if isinstance(value, datetime) else value
+                             for key, value in ((name, getattr(item, name)) for name in item.__slots__)})
+    return payloads
+
+
+def spotprice_payloads(days: int) -> list[dict]:
+    start = datetime(2025, 10, 1, 22, tzinfo=timezone.utc)
+    return [
+        SpotPriceSeries(area, (start + timedelta(days=day, hours=2)).date(), start + timedelta(days=day), 15, "DKK",
+                        [round(random.uniform(-50, 1500), 2) for _ in range(96)]).to_payload()
+        for day in range(days) for area in ("DK1", "DK2")
+    ]
+
+
+def main() -> None:
+    bandwidth = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+    bytes_per_second = bandwidth * 1_000_000 / 8
+
+    cases = {
+        "1 charge": charge_payloads(1)[0],
+        "200 charges (bulk)": charge_payloads(200),
+        "100 taxes/tarifs (bulk)": tax_tarif_payloads(50),
+        "7 days spot prices (bulk)": spotprice_payloads(7),
+    }
+    print(f"Upload time estimated at {bandwidth:g} Mbit/s, compression best of {REPEAT}")
+    print(f"{'payload':>26} {'method':>9} {'bytes':>9} {'ratio':>6} {'compress':>9} {'upload':>9} {'saved':>9}")
+    for name, payload in cases.items():
+        raw = encode_body(payload)
+        raw_upload = len(raw) / bytes_per_second
+        print(f"{name:>26} {'none':>9} {len(raw):>9} {1:>6.2f} {0:>7.2f}ms {raw_upload * 1000:>7.2f}ms {0:>7.2f}ms")
+        for method, level in (("gzip", 1), ("gzip", 6), ("deflate", 6)):
+            body, _ = compress_body(raw, method, min_bytes=0, level=level)
+            seconds = min(timeit.repeat(lambda: compress_body(raw, method, min_bytes=0, level=level), number=1, repeat=REPEAT))
+            upload = len(body) / bytes_per_second
+            saved = raw_upload - upload - seconds
+            print(f"{'':>26} {f'{method}-{level}':>9} {len(body):>9} {len(raw) / len(body):>6.2f} "
+                  f"{seconds * 1000:>7.2f}ms {upload * 1000:>7.2f}ms {saved * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Micro-benchmark of the DatahubPricelist record decoding.
+
+Compares the per-key loop Connector used to run on every record with the
+compiled PricelistDecoder. Run with `python bench_decoder.py`.
+"""
+import random
+import timeit
+
+from pricelist_decoder import DATAHUB_PRICELIST_DECODER
+
+RECORDS = 2500
+REPEAT = 5
+
+
+def make_records(count: int) -> list[dict]:
+    records = []
+    for i in range(count):
+        record = {
+            "ChargeOwner": "Radius Elnet A/S",
+            "GLN_Number": "5790000610099",
+            "ChargeType": "D03",
+            "ChargeTypeCode": "DT_C_01",
+            "Note": "Nettarif C",
+            "Description": "Nettarif C",
+            "ValidFrom": f"{2015 + i // 365}-01-01T00:00:00",
+            "ValidTo": None,
+            "VATClass": "D02",
+        }
+        daily = i % 3 == 0  # Daily tariffs only carry Price1
+        for hour in range(1, 25):
+            record[f"Price{hour}"] = None if daily and hour > 1 else round(random.uniform(0.05, 1.2), 6)
+        record.update({"TransparentInvoicing": 0, "TaxIndicator": 0, "ResolutionDuration": "PT1H"})
+        records.append(record)
+    return records
+
+
+def legacy_parse(entry: dict) -> dict:
+    """The loop Connector ran per record before the compiled decoder."""
+    tariff_data = {}
+    baseprice = 0
+    for key, val in entry.items():
+        if key == "Price1":
+            baseprice = val
+        if "Price" in key:
+            hour = "price" + str(int("".join(filter(str.isdigit, key))) - 1)
+            current_val = val if val is not None else baseprice
+            tariff_data.update({hour: current_val})
+        if key == "ValidTo":
+            tariff_data.update({"ValidTo": val})
+        if key == "ValidFrom":
+            tariff_data.update({"ValidFrom": val})
+        if key == "Note":
+            tariff_data.update({"Note": val})
+        if key == "Description":
+            tariff_data.update({"Description": val})
+        if key == "ChargeType":
+            tariff_data.update({"ChargeType": val})
+        if key == "ChargeTypeCode":
+            tariff_data.update({"ChargeTypeCode": val})
+    return tariff_data
+
+
+def main() -> None:
+    records = make_records(RECORDS)
+    decoder = DATAHUB_PRICELIST_DECODER
+
+    assert all(legacy_parse(record) == decoder.decode_tariff(record) for record in records)
+
+    cases = {
+        "legacy loop": lambda: [legacy_parse(record) for record in records],
+        "decode_tariff": lambda: [decoder.decode_tariff(record) for record in records],
+        "decode_page": lambda: decoder.decode_page(records),
+    }
+    baseline = None
+    print(f"{RECORDS} records, best of {REPEAT}")
+    for name, case in cases.items():
+        best = min(timeit.repeat(case, number=1, repeat=REPEAT))
+        baseline = baseline or best
+        print(f"{name:>14}: {best * 1000:8.2f} ms  {baseline / best:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark of the cold start import cost of the function app.
+
+Imports each module in fresh interpreters, as a new worker does, and reports the
+median time next to the modules that took longest according to `python -X importtime`.
+function_app is what the host imports to index the functions, app_main is loaded by
+the first sync. Run with `python bench_import.py [--runs N] [--max-ms MS]`, the
+latter fails when importing function_app takes longer, which is how CI uses it.
+
+BASE_URL only has to be set for the imports, nothing is sent.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ("function_app", "app_main")
+TOP = 8
+
+_TIMED_IMPORT = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+
+def run(code: str, *options: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    env.setdefault("BASE_URL", "http://localhost")
+    return subprocess.run([sys.executable, *options, "-c", code], capture_output=True, text=True,
+                          env=env, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+
+def import_seconds(module: str, runs: int) -> list[float]:
+    return [float(run(_TIMED_IMPORT.format(module=module)).stdout.split()[-1]) for _ in range(runs)]
+
+
+def slowest_imports(module: str) -> list[tuple[int, str]]:
+    """Cumulative microseconds of the imports made directly by the module."""
+    totals = []
+    for line in run(f"import {module}", "-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # A module is printed after its imports, one level deeper, so the direct imports
+        # are the second level lines since the previous top level import
+        if not name.startswith("  "):
+            if name.strip() == module:
+                break
+            totals = []
+        elif not name.startswith("    "):
+            totals.append((int(cumulative), name.strip()))
+    return sorted(totals, reverse=True)[:TOP]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=7, help="fresh interpreters per module")
+    parser.add_argument("--max-ms", type=float, help="fail when importing function_app takes longer")
+    args = parser.parse_args()
+
+    medians = {}
+    for module in MODULES:
+        seconds = import_seconds(module, args.runs)
+        medians[module] = statistics.median(seconds) * 1000
+        print(f"{module}: median {medians[module]:.1f}ms, min {min(seconds) * 1000:.1f}ms over {args.runs} runs")
+        for cumulative, name in slowest_imports(module):
+            print(f"    {cumulative / 1000:>8.1f}ms  {name}")
+
+    if args.max_ms is not None and medians["function_app"] > args.max_ms:
+        print(f"Importing function_app took {medians['function_app']:.1f}ms, over the limit of {args.max_ms:g}ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
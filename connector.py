@@ -1,9 +1,19 @@
 from __future__ import annotations
-from aiohttp import ClientSession
-from async_retrying_ng import RetryError, retry
+from httpx import AsyncClient, Response
 from logging import getLogger
+from contextlib import aclosing
 from datetime import datetime
+import json
+import time
+from typing import AsyncIterator
+from urllib.parse import quote
+from eds_cache import CacheEntry, ResponseCache, response_cache
+from interval_index import IntervalIndex
+from json_stream import iter_json_array
 from models import ChargeOwner
+from pricelist_decoder import DATAHUB_PRICELIST_DECODER, PricelistDecoder
+from rate_limit import RateLimiter, RetryError, StatusError, eds_limiter
+from settings import settings
 
 
 _LOGGER = getLogger(__name__)
@@ -18,21 +28,33 @@ REGIONS = [
 
 BASE_URL = "https://api.energidataservice.dk/dataset/DatahubPricelist"
 
+SYSTEM_TARIFF_FILTER = '{"Note":["Elafgift","Systemtarif","Transmissions nettarif"],"GLN_Number":["5790000432752"]}'
+
+# Number of chargeowners combined in one bulk query, keeps the filter url short
+BULK_CHUNK_SIZE = 50
+
+# Number of records requested per page
+PAGE_SIZE = settings.eds_page_size
+
 __all__ = ["Connector", "REGIONS", "CHARGEOWNERS"]
 
 class Connector:
     """Energi Data Service API."""
     def __init__(
-        self, client: ClientSession, chargeowner: ChargeOwner | None = None
+        self, client: AsyncClient, chargeowner: ChargeOwner | None = None, page_size: int = PAGE_SIZE,
+        cache: ResponseCache | None = response_cache, decoder: PricelistDecoder = DATAHUB_PRICELIST_DECODER,
+        limiter: RateLimiter = eds_limiter,
     ) -> None:
         """Init API connection to Energi Data Service."""
         self._chargeowner = chargeowner
         self._tariffs = {}
         self._additional_tariff = {}
-        self._all_tariffs = {}
-        self._all_additional_tariffs = {}
         self.status = 418
         self.client = client
+        self.page_size = page_size
+        self.cache = cache
+        self.decoder = decoder
+        self.limiter = limiter
 
     @property
     def tariffs(self):
@@ -72,9 +94,7 @@ class Connector:
 
         try:
             chargeowner = chargeowner
-            
-            limit = "limit=2500"
-            
+
             objfilter = 'filter=%7B"chargetypecode": ["{}"],"gln_number": ["{}"],"chargetype": {}%7D'.format(  # pylint: disable=consider-using-f-string
                 chargetypecode,
                 chargeowner.glnnumber,
@@ -86,57 +106,30 @@ class Connector:
             else:
                 sort = "sort=ValidFrom desc"
 
-            query = f"{objfilter}&{sort}&{limit}"
-            resp = await self.async_call_api(query)
+            query = f"{objfilter}&{sort}"
 
-            if len(resp) == 0:
+            # Consume the records page by page, the first tariff stops at the first later period
+            entries = []
+            async with aclosing(self.async_iter_records(query)) as records:
+                async for entry in records:
+                    if not entries and get_first:
+                        check_date = entry["ValidFrom"].split("T")[0]
+                        _LOGGER.debug("Using first tariff date: %s", check_date)
+
+                    if get_first and entry["ValidFrom"].split("T")[0] > check_date:
+                        # Sorted ascending, no later entry can cover check_date
+                        break
+                    entries.append(entry)
+
+            if not entries:
                 _LOGGER.warning(
                     "Could not fetch tariff data from Energi Data Service DataHub!"
                 )
                 return
-            else:
-                # We got data from the DataHub - update the dataset
-
-                self._all_tariffs = resp
-
-            if get_first:
-                check_date = self._all_tariffs[0]["ValidFrom"].split("T")[0]
-                _LOGGER.debug("Using first tariff date: %s", check_date)
 
-            
-
-            tariff_data = {}
-            for entry in self._all_tariffs:
-                if self.__entry_in_range(entry, check_date):
-                    _LOGGER.debug("Found possible dataset: %s", entry)
-                    baseprice = 0
-                    for key, val in entry.items():
-                        if key == "Price1":
-                            baseprice = val
-                        if "Price" in key:
-                            hour = "price" + str(int("".join(filter(str.isdigit, key))) - 1)
-
-                            current_val = val if val is not None else baseprice
-
-                            # if len(tariff_data) == 24:
-                            #     current_val += tariff_data[hour]
-
-                            tariff_data.update({hour: current_val})
-                        if key == "ValidTo":
-                            tariff_data.update({"ValidTo": val})
-                        if key == "ValidFrom":
-                            tariff_data.update({"ValidFrom": val})
-                        if key == "Note":
-                            tariff_data.update({"Note": val})
-                        if key == "Description":
-                            tariff_data.update({"Description": val})
-                        if key == "ChargeType":
-                            tariff_data.update({"ChargeType": val})
-                        if key == "ChargeTypeCode":
-                            tariff_data.update({"ChargeTypeCode": val})
-
-                    if len(tariff_data) == 24 + 6:  # 24 hours + 6 additional fields
-                        self._tariffs.update(tariff_data)
+            tariff_data = self.select_tariff(entries, check_date)
+            if tariff_data:
+                self._tariffs.update(tariff_data)
 
             return self.tariffs
         except KeyError:
@@ -148,6 +141,159 @@ class Connector:
         except RetryError:
             _LOGGER.error("Retry attempts exceeded for tariffs request.")
 
+    async def async_get_tariff_timeline(self, chargeowner: ChargeOwner, chargetypecode: str, date: datetime,
+                                        until: datetime | None = None, entries: list[dict] | None = None) -> list[dict]:
+        """Get every consecutive tariff period from date until now from a single download.
+
+        entries are the price list records of the owner when they were already fetched,
+        e.g. by `async_get_pricelists_bulk`, nothing is downloaded then.
+        Returns a list of tariffs in the format of `async_get_tariffs`, oldest first.
+        Raises RetryError when Energi Data Service could not be asked, so a failed
+        request is not mistaken for an owner without newer periods.
+        """
+        check_date = date.strftime("%Y-%m-%d")
+        if entries is None:
+            entries = await self.async_get_pricelist(chargeowner, chargetypecode)
+        # Only entries still valid after date can be part of the timeline
+        entries = [
+            entry
+            for entry in entries
+            if entry["ValidTo"] is None or entry["ValidTo"].split("T")[0] > check_date
+        ]
+
+        return [{"tariffs": tariff} for tariff in self.resolve_timeline(entries, date, until)]
+
+    async def async_get_pricelist(self, chargeowner: ChargeOwner, chargetypecode: str) -> list[dict]:
+        """Get every price list record of a chargeowner, oldest first."""
+        objfilter = 'filter=%7B"chargetypecode": ["{}"],"gln_number": ["{}"],"chargetype": {}%7D'.format(  # pylint: disable=consider-using-f-string
+            chargetypecode,
+            chargeowner.glnnumber,
+            chargeowner.chargetype.replace("'", '"'),
+            )
+        query = f"{objfilter}&sort=ValidFrom asc"
+        return [entry async for entry in self.async_iter_records(query)]
+
+    def resolve_timeline(self, entries: list[dict] | IntervalIndex, date: datetime, until: datetime | None = None) -> list[dict]:
+        """Follow the validity periods in entries from date, one period after the other.
+
+        Stops at an open ended period, a gap in the entries or when a period starts after until.
+        """
+        index = entries if isinstance(entries, IntervalIndex) else IntervalIndex(entries)
+        until = until or datetime.now()
+        timeline = []
+        while date < until:
+            tariff_data = self.select_indexed(index, date)
+            if not tariff_data:
+                break
+            timeline.append(tariff_data)
+            if tariff_data["ValidTo"] is None:
+                break
+            valid_to = datetime.fromisoformat(tariff_data["ValidTo"])
+            if valid_to <= date:
+                break
+            date = valid_to
+        return timeline
+
+    async def async_get_pricelists_bulk(self, chargeowners: list[ChargeOwner], get_first: bool) -> list[list[dict]]:
+        """Get the price list records of many chargeowners with one query per chunk of owners.
+
+        The records are split locally by (GLN, chargetype, chargetypecode) and returned
+        in the same order as `chargeowners`, sorted on ValidFrom like `async_get_tariffs`.
+        """
+        results = [[] for _ in chargeowners]
+        sort = "ValidFrom asc" if get_first else "ValidFrom desc"
+
+        for start in range(0, len(chargeowners), BULK_CHUNK_SIZE):
+            chunk = chargeowners[start:start + BULK_CHUNK_SIZE]
+            owner_chargetypes = [self.chargetypes(chargeowner) for chargeowner in chunk]
+
+            objfilter = {
+                "chargetypecode": sorted({chargeowner.chargetypecode for chargeowner in chunk}),
+                "gln_number": sorted({chargeowner.glnnumber for chargeowner in chunk}),
+                "chargetype": sorted({chargetype for chargetypes in owner_chargetypes for chargetype in chargetypes}),
+            }
+            query = f"filter={quote(json.dumps(objfilter))}&sort={quote(sort)}"
+
+            partitions: dict[tuple, list[dict]] = {}
+            async for entry in self.async_iter_records(query):
+                key = (entry.get("GLN_Number"), entry.get("ChargeType"), entry.get("ChargeTypeCode"))
+                partitions.setdefault(key, []).append(entry)
+
+            for index, chargeowner in enumerate(chunk):
+                owner_records = []
+                for chargetype in owner_chargetypes[index]:
+                    owner_records.extend(
+                        partitions.get((chargeowner.glnnumber, chargetype, chargeowner.chargetypecode), [])
+                    )
+                if len(owner_chargetypes[index]) > 1:
+                    owner_records.sort(key=lambda entry: entry["ValidFrom"], reverse=not get_first)
+                results[start + index] = owner_records
+
+        return results
+
+    async def async_get_tariffs_bulk(self, chargeowners: list[ChargeOwner], get_first: bool, date: datetime | None = None) -> list[dict | None]:
+        """Get tariffs for many chargeowners at once.
+
+        Returns one entry per chargeowner, in the same format as `async_get_tariffs`,
+        or None if Energi Data Service had no data for that owner. Raises RetryError
+        when Energi Data Service could not be asked, so no data is not confused with
+        a failed request.
+        """
+        if date is None:
+            check_date = (datetime.utcnow()).strftime("%Y-%m-%d")
+        else:
+            check_date = date.strftime("%Y-%m-%d")
+
+        pricelists = await self.async_get_pricelists_bulk(chargeowners, get_first)
+
+        results = []
+        for chargeowner, records in zip(chargeowners, pricelists):
+            if len(records) == 0:
+                _LOGGER.warning("No tariff data from Energi Data Service DataHub for %s", chargeowner.glnnumber)
+                results.append(None)
+                continue
+
+            if get_first:
+                results.append(self.first_tariff(records))
+            else:
+                results.append({"tariffs": self.select_tariff(records, check_date)})
+
+        return results
+
+    def first_tariff(self, entries: list[dict]) -> dict | None:
+        """The first tariff of an owner from its records sorted oldest first, None without records."""
+        if not entries:
+            return None
+        check_date = entries[0]["ValidFrom"].split("T")[0]
+        _LOGGER.debug("Using first tariff date: %s", check_date)
+        return {"tariffs": self.select_tariff(entries, check_date)}
+
+    def select_tariff(self, entries: list[dict], check_date: str) -> dict:
+        """Build the tariff data from the newest entry valid on check_date."""
+        return self.select_indexed(IntervalIndex(entries), check_date)
+
+    def select_indexed(self, index: IntervalIndex, date: datetime | str) -> dict:
+        """Build the tariff data from the newest entry valid on date, looked up in the index."""
+        for entry in reversed(index.covering(date)):
+            _LOGGER.debug("Found possible dataset: %s", entry)
+            tariff_data = self.decoder.decode_tariff(entry)
+            if tariff_data is not None:
+                return tariff_data
+        return {}
+
+    @staticmethod
+    def chargetypes(chargeowner: ChargeOwner) -> list[str]:
+        """Return the chargetypes of a chargeowner, stored as a list literal.
+
+        Raises ValueError when the stored value is not a list literal.
+        """
+        chargetypes = json.loads(chargeowner.chargetype.replace("'", '"'))
+        if isinstance(chargetypes, str):
+            return [chargetypes]
+        if not isinstance(chargetypes, list):
+            raise ValueError(f"Chargetype of {chargeowner.glnnumber} is not a list: {chargeowner.chargetype}")
+        return chargetypes
+
     async def async_get_system_tariffs(self, date: datetime) -> dict:
         """Get additional system tariffs defined by the Danish government."""
         if date is None:
@@ -158,78 +304,145 @@ class Connector:
             check_date = date.strftime("%Y-%m-%d")
         
 
-        search_filter = '{"Note":["Elafgift","Systemtarif","Transmissions nettarif"],"GLN_Number":["5790000432752"]}'
-        limit = 500
-
-        query = f"filter={search_filter}&limit={limit}"
+        # Sorted so the paging is stable, the newest entry in range wins
+        query = f"filter={SYSTEM_TARIFF_FILTER}&sort=ValidFrom desc"
 
         try:
-            dataset = await self.async_call_api(query)
-
-            if len(dataset) == 0:
+            tariff_data = {}
+            tariffs = []
+            entries = [entry async for entry in self.async_iter_records(query)]
+            count = len(entries)
+            for entry in reversed(IntervalIndex(entries).covering(check_date)):
+                if entry["Note"] not in tariff_data:
+                    tariff = {
+                        "Note": entry["Note"],
+                        "ValidFrom": entry["ValidFrom"],
+                        "ValidTo": entry["ValidTo"],
+                        "ChargeType": entry["ChargeType"],
+                        "ChargeTypeCode": entry["ChargeTypeCode"],
+                        "Description": entry["Description"],
+                        "Price": float(entry["Price1"]),
+                    }
+
+                    tariffs.append(tariff)
+
+                    tariff_data.update(
+                        {entry["Note"]: float(entry["Price1"])}
+                    )
+
+            if count == 0:
                 _LOGGER.warning(
                     "Could not fetch tariff data from Energi Data Service DataHub!"
                 )
                 return
-            else:
-                self._all_additional_tariffs = dataset
-
-            tariff_data = {}
-            tariffs = []
-            for entry in self._all_additional_tariffs:
-                if self.__entry_in_range(entry, check_date):
-                    if entry["Note"] not in tariff_data:
-                        tariff = {
-                            "Note": entry["Note"],
-                            "ValidFrom": entry["ValidFrom"],
-                            "ValidTo": entry["ValidTo"],
-                            "ChargeType": entry["ChargeType"],
-                            "ChargeTypeCode": entry["ChargeTypeCode"],
-                            "Description": entry["Description"],
-                            "Price": float(entry["Price1"]),
-                        }
-
-                        tariffs.append(tariff)
-
-                        tariff_data.update(
-                            {entry["Note"]: float(entry["Price1"])}
-                        )
 
             self._additional_tariff = tariff_data
             return tariffs
         except RetryError:
             _LOGGER.error("Retry attempts exceeded for retrieving system tariffs.")
 
-    @retry(attempts=10, delay=10, max_delay=3600, backoff=1.5)
-    async def async_call_api(self, query: str) -> dict:
+    async def async_get_system_tariff_entries(self) -> list[dict]:
+        """Get every Elafgift, Systemtarif and Transmissions nettarif record, oldest first."""
+        query = f"filter={SYSTEM_TARIFF_FILTER}&sort=ValidFrom asc"
+        try:
+            return [entry async for entry in self.async_iter_records(query)]
+        except RetryError:
+            _LOGGER.error("Retry attempts exceeded for retrieving system tariffs.")
+            return []
+
+    async def async_iter_records(self, query: str, page_size: int | None = None) -> AsyncIterator[dict]:
+        """Page through the dataset with offset/limit and yield the records as they arrive."""
+        page_size = page_size or self.page_size
+        offset = 0
+        while True:
+            count = 0
+            async for entry in self.async_stream_page(f"{query}&offset={offset}&limit={page_size}"):
+                count += 1
+                yield entry
+            if count < page_size:
+                return
+            offset += count
+
+    async def async_stream_page(self, query: str) -> AsyncIterator[dict]:
+        """Yield the records of one request while they are parsed from the response stream.
+
+        Without a cache only the record being parsed is held in memory, with a cache
+        the page is collected to be stored once it is complete, unless it grows past
+        what the cache keeps.
+        """
+        records, resp, key = await self._async_open(query)
+        if resp is None:
+            for entry in records:
+                yield entry
+            return
+
+        collected = [] if self.cache is not None else None
+        try:
+            async for entry in iter_json_array(resp.aiter_bytes(), "records"):
+                if collected is not None:
+                    collected.append(entry)
+                    if not self.cache.cacheable(len(collected)):
+                        collected = None
+                yield entry
+        finally:
+            await resp.aclose()
+
+        if collected is not None:
+            self.cache.put(key, CacheEntry(
+                collected, time.time(), resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+            ))
+
+    async def async_call_api(self, query: str) -> list:
         """Make the API calls."""
+        return [entry async for entry in self.async_stream_page(query)]
+
+    async def _async_open(self, query: str) -> tuple[list, Response | None, str | None]:
+        """Send the request and return the cached records, or the response to stream them from."""
         try:
+            key = cached = None
+            if self.cache is not None:
+                key = self.cache.key(query)
+                cached = self.cache.get(key)
+                if cached is not None and self.cache.is_fresh(cached):
+                    self.cache.hits += 1
+                    return cached.records, None, key
+
             headers = self._header()
+            if cached is not None:
+                # Let Energi Data Service answer 304 when the data did not change
+                if cached.etag:
+                    headers["If-None-Match"] = cached.etag
+                if cached.last_modified:
+                    headers["If-Modified-Since"] = cached.last_modified
+
             url = f"{BASE_URL}?{query}"
-            resp = await self.client.get(url, headers=headers)
-            self.status = resp.status
-            resp.raise_for_status()
+            # Rate limited and retried on throttling and server errors, shared with all Connectors
+            resp = await self.limiter.call(
+                lambda: self.client.send(self.client.build_request("GET", url, headers=headers), stream=True)
+            )
+            self.status = resp.status_code
 
-            if resp.status == 400:
+            if resp.status_code == 200:
+                if self.cache is not None:
+                    self.cache.misses += 1
+                return [], resp, key
+
+            await resp.aclose()
+            if resp.status_code == 304 and cached is not None:
+                self.cache.revalidated += 1
+                self.cache.touch(key, cached)
+                return cached.records, None, key
+
+            if resp.status_code == 400:
                 _LOGGER.error("API returned error 400, Bad Request!")
-                return {}
-            elif resp.status == 411:
+            elif resp.status_code == 411:
                 _LOGGER.error("API returned error 411, Invalid Request!")
-                return {}
-            elif resp.status == 200:
-                res = await resp.json()
-                return res["records"]
             else:
-                _LOGGER.error("API returned error %s", str(resp.status))
-                return {}
+                _LOGGER.error("API returned error %s", str(resp.status_code))
+            # An empty page would read as the end of the data and silently cut the price list short
+            raise StatusError(f"Energi Data Service returned {resp.status_code}", resp.status_code)
         except Exception as exc:
             _LOGGER.error("Error during API request: %s", exc)
             raise
     
-    def __entry_in_range(self, entry, check_date) -> bool:
-        """Check if an entry is witin the date range."""
-        return (entry["ValidFrom"].split("T"))[0] <= check_date and (
-            entry["ValidTo"] is None or (entry["ValidTo"].split("T"))[0] > check_date
-        )
-    
 
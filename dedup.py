@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import hashlib
+import json
+import logging
+
+from settings import connect_state_db, settings
+
+_logger = logging.getLogger(__name__)
+
+# Skip writes of payloads the backend already has
+DEDUP_ENABLED = settings.backend_dedup
+# Hashes of the payloads the backend accepted, kept between runs
+DEDUP_DB = settings.backend_dedup_db
+# A payload is sent again after this many days even if unchanged, in case the backend lost it
+DEDUP_MAX_AGE_DAYS = settings.backend_dedup_max_age_days
+
+
+def _normalize(value):
+    if isinstance(value, float):
+        return round(value, 6) + 0.0  # Also turns -0.0 into 0.0
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def payload_hash(payload) -> str:
+    """Stable hash of a payload, independent of key order and float noise."""
+    text = json.dumps(_normalize(payload), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class HashIndex:
+    """Hashes of the payloads already written per backend path, in a SQLite file."""
+
+    def __init__(self, path: str = DEDUP_DB, max_age_days: float = DEDUP_MAX_AGE_DAYS) -> None:
+        self.max_age = timedelta(days=max_age_days)
+        self.skipped = 0
+        self._db = connect_state_db(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS written ("
+            " path TEXT NOT NULL, hash TEXT NOT NULL, written_at TEXT NOT NULL,"
+            " PRIMARY KEY (path, hash))"
+        )
+        self._db.commit()
+
+    def seen(self, path: str, key: str) -> bool:
+        """True when the same payload was written to path within max_age."""
+        row = self._db.execute(
+            "SELECT written_at FROM written WHERE path = ? AND hash = ?", (path, key)
+        ).fetchone()
+        return row is not None and datetime.now() - datetime.fromisoformat(row[0]) < self.max_age
+
+    def add(self, path: str, key: str) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO written (path, hash, written_at) VALUES (?, ?, ?)",
+            (path, key, datetime.now().isoformat()),
+        )
+        self._db.commit()
+
+    def prune(self) -> None:
+        """Drop the hashes that are too old to be used."""
+        cutoff = (datetime.now() - self.max_age).isoformat()
+        self._db.execute("DELETE FROM written WHERE written_at < ?", (cutoff,))
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
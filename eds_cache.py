@@ -0,0 +1,177 @@
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+import hashlib
+import json
+from logging import getLogger
+import os
+import time
+from urllib.parse import parse_qsl
+from settings import settings
+
+_LOGGER = getLogger(__name__)
+
+# Seconds a cached response is used without asking Energi Data Service
+EDS_CACHE_TTL = settings.eds_cache_ttl
+EDS_CACHE_MAX_ENTRIES = settings.eds_cache_max_entries
+# The in-memory layer lives as long as the worker, so it is bounded by the records it holds.
+# Larger pages are not cached at all, they are streamed without being collected.
+EDS_CACHE_MAX_RECORDS = settings.eds_cache_max_records
+EDS_CACHE_MAX_PAGE_RECORDS = settings.eds_cache_max_page_records
+# Optional on-disk layer, e.g. a folder under /tmp on the Functions host
+EDS_CACHE_DIR = settings.eds_cache_dir
+EDS_CACHE_MAX_BYTES = settings.eds_cache_max_bytes
+
+
+@dataclass
+class CacheEntry:
+    records: list
+    stored_at: float
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+class ResponseCache:
+    """Cache of Energi Data Service responses keyed on the normalized query.
+
+    Entries are kept in an in-memory LRU bounded by entries and records and, when a
+    directory is given, in a size-bounded LRU on disk. Pages of more than
+    max_page_records records are not cached. Fresh entries are served without a request, stale
+    entries are revalidated with ETag/Last-Modified when the response had them.
+    """
+
+    def __init__(self, ttl: float = EDS_CACHE_TTL, max_entries: int = EDS_CACHE_MAX_ENTRIES,
+                 directory: str | None = EDS_CACHE_DIR, max_bytes: int = EDS_CACHE_MAX_BYTES,
+                 max_records: int = EDS_CACHE_MAX_RECORDS, max_page_records: int = EDS_CACHE_MAX_PAGE_RECORDS) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_records = max_records
+        self.max_page_records = max_page_records
+        self._records = 0
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._memory: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(query: str) -> str:
+        """Normalize a query so equal filters in another order share an entry."""
+        params = []
+        for name, value in parse_qsl(query, keep_blank_values=True):
+            if name == "filter":
+                try:
+                    objfilter = json.loads(value)
+                    value = json.dumps(
+                        {k: sorted(v) if isinstance(v, list) else v for k, v in objfilter.items()},
+                        sort_keys=True,
+                    )
+                except (ValueError, AttributeError, TypeError):
+                    pass
+            params.append((name, value.strip()))
+        return "&".join(f"{name}={value}" for name, value in sorted(params))
+
+    def get(self, key: str) -> CacheEntry | None:
+        entry = self._memory.get(key)
+        if entry is not None:
+            self._memory.move_to_end(key)
+            return entry
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.stored_at < self.ttl
+
+    def cacheable(self, records: int) -> bool:
+        return records <= self.max_page_records
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        if not self.cacheable(len(entry.records)):
+            return
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def touch(self, key: str, entry: CacheEntry) -> None:
+        """Mark a revalidated entry as fresh again."""
+        entry.stored_at = time.time()
+        self.put(key, entry)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "revalidated": self.revalidated,
+                "entries": len(self._memory), "records": self._records}
+
+    def clear(self) -> None:
+        self._memory.clear()
+        self._records = 0
+        if self.directory:
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.directory, name))
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._records -= len(previous.records)
+        self._memory[key] = entry
+        self._records += len(entry.records)
+        while self._memory and (len(self._memory) > self.max_entries or self._records > self.max_records):
+            _, evicted = self._memory.popitem(last=False)
+            self._records -= len(evicted.records)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def _read_disk(self, key: str) -> CacheEntry | None:
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, encoding="utf-8") as file:
+                entry = CacheEntry(**json.load(file))
+            os.utime(path)  # Recently used, evicted last
+            return entry
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as exc:
+            _LOGGER.warning("Dropping unreadable cache file %s: %s", path, exc)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, key: str, entry: CacheEntry) -> None:
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as file:
+                json.dump(asdict(entry), file)
+            os.replace(path + ".tmp", path)
+            self._evict_disk()
+        except OSError as exc:
+            _LOGGER.warning("Could not write cache file %s: %s", path, exc)
+
+    def _evict_disk(self) -> None:
+        """Remove the least recently used files until the cache fits in max_bytes."""
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            files.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,196 @@
+"""
+Local stand-in for the HEADS backend, for trying the writers without the real service.
+
+Run it with `python fake_backend.py --port 8000` and point BASE_URL at http://localhost:8000.
+Everything is kept in memory and lost when the server stops.
+"""
+import argparse
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import threading
+from urllib.parse import parse_qs
+import zlib
+
+_logger = logging.getLogger(__name__)
+
+TOKEN = "fake-token"
+
+# Fields a payload must have to be accepted on each path
+REQUIRED_FIELDS = {
+    "/charge": ["chargeowner_id", "charge_type_code", "valid_from", "valid_to"] + [f"price{i}" for i in range(1, 25)],
+    "/tax": ["valid_from", "valid_to", "taxammount"],
+    "/tarif": ["valid_from", "valid_to", "nettarif", "systemtarif"],
+    "/spotprice/nordpool": [],
+    "/spotprice/series": ["area", "delivery_date", "start", "resolution_minutes", "currency", "prices"],
+}
+
+
+class _Server(ThreadingHTTPServer):
+    # The writers open many connections at once
+    request_queue_size = 128
+
+
+class FakeBackend:
+    """In-memory HEADS backend on a background thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, bulk: bool = True, compression: bool = True) -> None:
+        self.bulk = bulk
+        self.compression = compression
+        self.records: dict[str, list[dict]] = {path: [] for path in REQUIRED_FIELDS}
+        self.requests: list[tuple[str, str]] = []
+        self.chargeowners: list[dict] = []
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeBackend":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def store(self, path: str, payload) -> dict:
+        """Validate and store one payload, returns the per item result."""
+        if not isinstance(payload, dict):
+            return {"ok": False, "status_code": 422, "error": "payload must be an object"}
+        missing = [field for field in REQUIRED_FIELDS[path] if payload.get(field) is None]
+        if missing:
+            return {"ok": False, "status_code": 422, "error": f"missing fields: {', '.join(missing)}"}
+        with self._lock:
+            self.records[path].append(payload)
+        return {"ok": True}
+
+    def latest(self, path: str) -> dict:
+        with self._lock:
+            stored = self.records[path]
+            if not stored:
+                return {"valid_from": None, "valid_to": "9999-12-31T23:59:59"}
+            return max(stored, key=lambda record: record["valid_from"])
+
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                _logger.debug(format, *args)
+
+            def _reply(self, status: int, body=None) -> None:
+                data = json.dumps(body if body is not None else {}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self) -> bytes | None:
+                """The request body, decompressed. None after answering 415 for an unsupported encoding."""
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                encoding = self.headers.get("Content-Encoding", "identity").lower()
+                if encoding == "identity":
+                    return body
+                if encoding == "gzip" and backend.compression:
+                    return gzip.decompress(body)
+                if encoding == "deflate" and backend.compression:
+                    return zlib.decompress(body)
+                self._reply(415, {"detail": f"Unsupported Content-Encoding {encoding}"})
+                return None
+
+            def _authorized(self) -> bool:
+                if self.headers.get("Authorization") == f"Bearer {TOKEN}":
+                    return True
+                self._reply(401, {"detail": "Not authenticated"})
+                return False
+
+            def do_GET(self):
+                backend.requests.append(("GET", self.path))
+                if not self._authorized():
+                    return
+                if self.path == "/watermark":
+                    self._reply(200, {
+                        "spotprices_max_date": None, "charges_max_date": None,
+                        "taxes_max_date": None, "tarifs_max_date": None,
+                    })
+                elif self.path in ("/chargeowner", "/chargeowner/with-latest-charge"):
+                    self._reply(200, backend.chargeowners)
+                elif self.path == "/tarif/latest":
+                    self._reply(200, backend.latest("/tarif"))
+                elif self.path == "/tax/latest":
+                    self._reply(200, backend.latest("/tax"))
+                else:
+                    self._reply(404, {"detail": "Not Found"})
+
+            def do_POST(self):
+                backend.requests.append(("POST", self.path))
+                body = self._body()
+                if body is None:
+                    return
+                if self.path == "/auth/login":
+                    form = parse_qs(body.decode())
+                    if form.get("username") and form.get("password"):
+                        self._reply(200, {"access_token": TOKEN, "token_type": "bearer"})
+                    else:
+                        self._reply(401, {"detail": "Incorrect username or password"})
+                    return
+                if not self._authorized():
+                    return
+
+                path, bulk = self.path, False
+                if path.endswith("/bulk"):
+                    path, bulk = path[:-len("/bulk")], True
+                if path not in REQUIRED_FIELDS or (bulk and not backend.bulk):
+                    self._reply(404, {"detail": "Not Found"})
+                    return
+
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self._reply(400, {"detail": "Invalid JSON"})
+                    return
+
+                if bulk:
+                    if not isinstance(payload, list):
+                        self._reply(422, {"detail": "bulk payload must be a list"})
+                        return
+                    self._reply(200, {"results": [backend.store(path, item) for item in payload]})
+                else:
+                    result = backend.store(path, payload)
+                    self._reply(200 if result["ok"] else result["status_code"], result)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the HEADS backend.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--no-bulk", action="store_true", help="Answer 404 on the bulk endpoints")
+    parser.add_argument("--no-compression", action="store_true", help="Answer 415 on compressed request bodies")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    server = FakeBackend(args.host, args.port, bulk=not args.no_bulk, compression=not args.no_compression)
+    print(f"Fake HEADS backend listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
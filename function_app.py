@@ -1,14 +1,62 @@
 import azure.functions as func
+import json
 import logging
-from app_main import data_get_load
+from settings import settings
 
+# The sync code, app_main and everything it imports, is loaded by the first request
+# that needs it so the host indexes the functions quickly on a cold start
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+# Answer HEADS with 202 and a job id instead of holding the request for the whole sync
+JOB_MODE_SW = settings.job_mode
+
+_job_queue = None
+
+
+def get_job_queue():
+    """The job queue of this worker, its store is opened on first use."""
+    global _job_queue
+    if _job_queue is None:
+        from jobs import InProcessQueue, JobStore
+        _job_queue = InProcessQueue(JobStore())
+    return _job_queue
+
+
+async def run_job(progress) -> bool:
+    from app_main import data_get_load
+    response = await data_get_load(progress)
+    if response.status_code >= 400:
+        progress.job.error = response.get_body().decode()
+        return False
+    return True
+
+
 @app.route(route="HEADS")
 async def HEADS(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
-    await data_get_load()
+    if not JOB_MODE_SW or req.params.get("wait", "").lower() == "true":
+        from app_main import data_get_load
+        await data_get_load()
+        return func.HttpResponse(f"This HTTP triggered function executed successfully.")
+
+    # A sync already in progress is reported instead of starting a second one
+    job, started = get_job_queue().submit(run_job)
+    logging.info(f"{'Started' if started else 'Already running'} sync job {job.id}")
+    status_url = f"{req.url.split('?')[0].rstrip('/')}/jobs/{job.id}"
+    body = job.to_dict()
+    body["status_url"] = status_url
+    return func.HttpResponse(
+        json.dumps(body),
+        status_code=202,
+        mimetype="application/json",
+        headers={"Location": status_url},
+    )
 
 
-    return func.HttpResponse(f"This HTTP triggered function executed successfully.")
+@app.route(route="HEADS/jobs/{job_id}", methods=["GET"])
+async def HEADS_job_status(req: func.HttpRequest) -> func.HttpResponse:
+    job = get_job_queue().store.get(req.route_params.get("job_id"))
+    if job is None:
+        return func.HttpResponse("Unknown job.", status_code=404)
+    return func.HttpResponse(json.dumps(job.to_dict()), status_code=200, mimetype="application/json")
@@ -1,15 +1,13 @@
 import httpx
-from dotenv import load_dotenv
-import os
+from login import authorized_request
 import logging
 from models import ChargeownerLatestCharge
+from settings import settings
 
 logging.basicConfig(level=logging.INFO)
 _logger = logging.getLogger(__name__)
 
-load_dotenv()
-
-BASE_URL = os.getenv("BASE_URL")
+BASE_URL = settings.base_url
 
 
 async def load_chargeowners_with_last_charge(token) -> list[ChargeownerLatestCharge] | None:
@@ -17,12 +15,10 @@ async def load_chargeowners_with_last_charge(token) -> list[ChargeownerLatestCha
 
     url = f"{BASE_URL}/chargeowner/with-latest-charge"
     headers = {
-        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
         "Accept": "application/json"
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
+    response = await authorized_request("GET", url, token, headers=headers)
 
     chargeowners = []
 
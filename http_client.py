@@ -0,0 +1,53 @@
+import asyncio
+
+import httpx
+from settings import settings
+
+# Connection pool and timeout settings, shared by every host we talk to
+MAX_CONNECTIONS = settings.http_max_connections
+MAX_KEEPALIVE_CONNECTIONS = settings.http_max_keepalive_connections
+KEEPALIVE_EXPIRY = settings.http_keepalive_expiry
+TIMEOUT = settings.http_timeout
+CONNECT_TIMEOUT = settings.http_connect_timeout
+# Compressed responses are decoded by httpx while they stream in, add "br" with the brotli package installed
+ACCEPT_ENCODING = settings.http_accept_encoding
+
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+
+
+def create_client(**kwargs) -> httpx.AsyncClient:
+    """Create a client with the configured limits and timeouts."""
+    kwargs.setdefault("limits", httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    ))
+    kwargs.setdefault("timeout", httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT))
+    kwargs.setdefault("headers", {"Accept-Encoding": ACCEPT_ENCODING})
+    return httpx.AsyncClient(**kwargs)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the shared client.
+
+    httpx keeps a connection pool per host, so the backend, Energi Data Service and
+    Nord Pool all reuse warm connections. The client lives in the module, on a warm
+    Functions worker the next invocation picks up the same connections. A new client
+    is only made when the event loop changed, e.g. between asyncio.run calls.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = create_client()
+        _client_loop = loop
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client, the next get_client call creates a new one."""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
@@ -1,35 +1,21 @@
-from dataclasses import asdict
-from datetime import datetime, timedelta
-import os
+from datetime import datetime
 
-from dotenv import load_dotenv
 from models import Charge
-import requests
-
-load_dotenv()
+from backend_writer import BackendWriter, BatchWriter, post
+from settings import settings
 
 # Use a far future date as a default
 FUTURE_DATE = datetime(9999, 12, 31, 23, 59, 59)
 
-BASE_URL = os.getenv("BASE_URL")
-if not BASE_URL:
-    raise ValueError("BASEURL environment variable is not set. Please check your .env file.")
+BASE_URL = settings.require_base_url()
 
 
 def safe_parse_date(value, default=None):
     if value is None:
         return default
     return datetime.fromisoformat(value)
-    
-    # Helper to convert dataclass (with datetime) to JSON-safe dict
-def serialize_dataclass(obj):
-    def convert(value):
-        if isinstance(value, datetime):
-            return value.isoformat()
-        return value
-    return {k: convert(v) for k, v in asdict(obj).items()}
 
-async def insert_charge(tariff, owner, token):
+async def insert_charge(tariff, owner, token, writer: BackendWriter | BatchWriter | None = None):
     """Insert the tariff into the database."""
     # Implement your logic to insert the tariff into the database
     # For example, you can use an ORM or raw SQL to insert the tariff
@@ -45,24 +31,26 @@ async def insert_charge(tariff, owner, token):
         description=tariffs['Description'],
         valid_from = safe_parse_date(tariffs['ValidFrom']),
         valid_to = safe_parse_date(tariffs.get('ValidTo'), FUTURE_DATE),
-        **{f'price{i}': tariffs.get(f'price{i-1}', 0.0) for i in range(1, 25)}
+        prices=[tariffs.get(f'price{i}', 0.0) for i in range(24)],
     )
 
-    # Convert Charge object to JSON-serializable dict
-    charge_payload = serialize_dataclass(charge)
+    # Convert Charge object to the JSON payload with price1..price24
+    charge_payload = charge.to_payload()
 
     print (f"Inserting charge: {charge_payload}")
 
     # Send POST request
-    url = f"{BASE_URL}/charge"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
-    response = requests.post(url, headers=headers, json=charge_payload)
+    response = await post("/charge", charge_payload, token, writer)
 
     # Optional: check response
+    if response is None:
+        print("Charge queued for bulk upload.")
+        return True
+    if response.skipped:
+        print("Charge unchanged, not sent.")
+        return True
     if response.ok:
-        print("Charge submitted successfully.")
+        print(f"Charge submitted successfully in {response.latency * 1000:.0f} ms.")
     else:
-        print(f"Error: {response.status_code} - {response.text}")
\ No newline at end of file
+        print(f"Error: {response.status_code} - {response.text}")
+    return response.ok
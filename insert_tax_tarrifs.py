@@ -1,21 +1,17 @@
-import ast
-from asyncio.log import logger
 from dataclasses import asdict
-import json
-from dotenv import load_dotenv
-import requests
-from login import login
+from backend_writer import BackendWriter, BatchWriter, post
 from connector import Connector
-from models import ChargeOwner, Charge, Tarif, Tax
-import os
+from interval_index import IntervalIndex
+from latest_tarif import get_latest_tarif
+from latest_tax import get_latest_tax
+from models import Tarif, Tax
 import asyncio
-from aiohttp import ClientSession
 from datetime import datetime, timedelta
 
 from logging import getLogger
 import logging
 import sys
-load_dotenv()
+from settings import settings
 
 _logger = getLogger(__name__)
 
@@ -47,92 +43,140 @@ def safe_parse_date(date_str, default):
 
 _logger = getLogger(__name__)
 
-BASE_URL = os.getenv("BASE_URL")
-if not BASE_URL:
-    raise ValueError("BASEURL environment variable is not set. Please check your .env file.")
+BASE_URL = settings.require_base_url()
 
 
-def insert_tax(token, tax):
+async def insert_tax(token, tax, writer: BackendWriter | BatchWriter | None = None):
     """
     Send the tax and tarif to the server.
     """
-    url = f"{BASE_URL}/tax"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
         # Convert Charge object to JSON-serializable dict
     tax_payload = serialize_dataclass(tax)
-    response = requests.post(url, headers=headers, json=tax_payload)
-    if response.status_code == 200:
-        _logger.info("Tax sent successfully.")
+    response = await post("/tax", tax_payload, token, writer)
+    if response is None:
+        _logger.info("Tax queued for bulk upload.")
+    elif response.skipped:
+        _logger.info("Tax unchanged, not sent.")
+    elif response.status_code == 200:
+        _logger.info(f"Tax sent successfully in {response.latency * 1000:.0f} ms.")
     else:
         _logger.error(f"Failed to send tax: {response.status_code} - {response.text}")
 
-def insert_tarif(token, tarif):
+async def insert_tarif(token, tarif, writer: BackendWriter | BatchWriter | None = None):
     """
     Send the tarif to the server.
     """
-    url = f"{BASE_URL}/tarif"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
     tarif_payload = serialize_dataclass(tarif)
-    response = requests.post(url, headers=headers, json=tarif_payload)
-    if response.status_code == 200:
-        _logger.info("Tarif sent successfully.")
+    response = await post("/tarif", tarif_payload, token, writer)
+    if response is None:
+        _logger.info("Tarif queued for bulk upload.")
+    elif response.skipped:
+        _logger.info("Tarif unchanged, not sent.")
+    elif response.status_code == 200:
+        _logger.info(f"Tarif sent successfully in {response.latency * 1000:.0f} ms.")
     else:
         _logger.error(f"Failed to send tarif: {response.status_code} - {response.text}")
 
-async def insert_tax_and_tarif(token, tax_date: datetime, connector: Connector):
-    token = token
-    tax_tariffs = await connector.async_get_system_tariffs(tax_date)
-
-    for tarrif in tax_tariffs:
-        _logger.info(f"Processing tariff: {tarrif}")
-
-        if tarrif.get("Note") == "Elafgift":
-            # Convert the tariff to a Tax object
-            tax = Tax(
-                valid_from=datetime.fromisoformat(tarrif['ValidFrom']),
-                valid_to=safe_parse_date(tarrif['ValidTo'], FUTURE_DATE),
-                taxammount=tarrif.get("Price", 0.0),
-                includingVAT=False
-            )
-            _logger.info(f"Tax to be inserted: {tax}")
-            insert_tax(token, tax)
-        elif tarrif.get("Note") == "Systemtarif":
-            # Convert the tariff to a Tax object
-            Systemtarif = Tarif(
-                valid_from=datetime.fromisoformat(tarrif['ValidFrom']),
-                valid_to=safe_parse_date(tarrif['ValidTo'], FUTURE_DATE),
-                systemtarif=tarrif.get("Price", 0.0),
-                nettarif= 0.0,
-                includingVAT=False
-            )
-
-        elif tarrif.get("Note") == "Transmissions nettarif":
-            # Convert the tariff to a Tax object
-            nettarif = Tarif(
-                valid_from=datetime.fromisoformat(tarrif['ValidFrom']),
-                valid_to=safe_parse_date(tarrif['ValidTo'], FUTURE_DATE),
-                systemtarif=0.0,
-                nettarif=tarrif.get("Price", 0.0),
-                includingVAT=False
-            )
-
-    _tarif = Tarif(
-        valid_from=nettarif.valid_from,
-        valid_to=nettarif.valid_to,
-        systemtarif=Systemtarif.systemtarif,
-        nettarif=nettarif.nettarif,
+
+def _resume_date(valid_to, now: datetime) -> datetime:
+    """The date to continue from after the latest stored period."""
+    if isinstance(valid_to, str):
+        valid_to = datetime.fromisoformat(valid_to)
+    if valid_to is None or valid_to == FUTURE_DATE:
+        # Nothing stored or open ended, only look at the current period
+        return now - timedelta(days=1)
+    return valid_to
+
+
+def tax_from_tariff(tariff: dict) -> Tax:
+    """The Tax of an Elafgift period in the tariff data format."""
+    return Tax(
+        valid_from=datetime.fromisoformat(tariff['ValidFrom']),
+        valid_to=safe_parse_date(tariff['ValidTo'], FUTURE_DATE),
+        taxammount=float(tariff['price0']),
+        includingVAT=False
+    )
+
+
+def tarif_at(connector: Connector, systemtarif: IntervalIndex, nettarif: IntervalIndex, date: datetime) -> Tarif | None:
+    """The Tarif valid on date, None when the Systemtarif or the Transmissions nettarif is missing."""
+    system_data = connector.select_indexed(systemtarif, date)
+    net_data = connector.select_indexed(nettarif, date)
+    if not system_data or not net_data:
+        return None
+    return Tarif(
+        valid_from=max(datetime.fromisoformat(system_data['ValidFrom']), datetime.fromisoformat(net_data['ValidFrom'])),
+        valid_to=min(
+            safe_parse_date(system_data['ValidTo'], FUTURE_DATE),
+            safe_parse_date(net_data['ValidTo'], FUTURE_DATE),
+        ),
+        systemtarif=float(system_data['price0']),
+        nettarif=float(net_data['price0']),
         includingVAT=False
     )
-    
-    _logger.info(f"Tariff to be inserted: {_tarif}")
 
-    # Insert the tariff into the database
-    insert_tarif(token, _tarif)
 
+def system_tariff_indexes(entries: list[dict]) -> tuple[IntervalIndex, IntervalIndex, IntervalIndex]:
+    """Index the Elafgift, Systemtarif and Transmissions nettarif entries."""
+    return tuple(
+        IntervalIndex(entry for entry in entries if entry["Note"] == note)
+        for note in ("Elafgift", "Systemtarif", "Transmissions nettarif")
+    )
+
+
+def build_taxes(connector: Connector, entries: list[dict], start: datetime, now: datetime) -> list[Tax]:
+    """Every Elafgift period from start until now."""
+    elafgift, _, _ = system_tariff_indexes(entries)
+    return [tax_from_tariff(tariff) for tariff in connector.resolve_timeline(elafgift, start, now)]
+
+
+def build_tarifs(connector: Connector, entries: list[dict], start: datetime, now: datetime) -> list[Tarif]:
+    """Every Tarif period from start until now.
 
+    A new period starts whenever either the Systemtarif or the Transmissions nettarif changes.
+    """
+    _, systemtarif, nettarif = system_tariff_indexes(entries)
+
+    tarifs = []
+    date = start
+    while date < now:
+        tarif = tarif_at(connector, systemtarif, nettarif, date)
+        if tarif is None:
+            _logger.info(f"No system tariff or nettarif valid on {date}.")
+            break
+        tarifs.append(tarif)
+        if tarif.valid_to == FUTURE_DATE or tarif.valid_to <= date:
+            break
+        date = tarif.valid_to
+    return tarifs
+
+
+async def sync_system_tariffs(token, connector: Connector, writer: BackendWriter | BatchWriter | None = None) -> tuple[int, int]:
+    """
+    Download the system tariffs once and insert every missing Tax and Tarif period.
+    Returns the number of taxes and tarifs inserted.
+    """
+    now = datetime.now()
+    latest_tarif = await get_latest_tarif(token)
+    latest_tax = await get_latest_tax(token)
+    tarif_start = _resume_date(latest_tarif.valid_to if latest_tarif else None, now)
+    tax_start = _resume_date(latest_tax.valid_to if latest_tax else None, now)
+    _logger.info(f"Syncing taxes from {tax_start} and tarifs from {tarif_start}")
+
+    entries = await connector.async_get_system_tariff_entries()
+    if not entries:
+        _logger.warning("Could not fetch system tariffs from Energi Data Service DataHub!")
+        return 0, 0
+
+    taxes = build_taxes(connector, entries, tax_start, now)
+    tarifs = build_tarifs(connector, entries, tarif_start, now)
+    for tax in taxes:
+        _logger.info(f"Tax to be inserted: {tax}")
+    for tarif in tarifs:
+        _logger.info(f"Tariff to be inserted: {tarif}")
+
+    await asyncio.gather(
+        *(insert_tax(token, tax, writer) for tax in taxes),
+        *(insert_tarif(token, tarif, writer) for tarif in tarifs),
+    )
+    return len(taxes), len(tarifs)
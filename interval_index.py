@@ -0,0 +1,77 @@
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from typing import Iterable
+
+
+def _as_date(value: date | datetime | str | None, default: date) -> date:
+    if value is None:
+        return default
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value[:10])
+
+
+class IntervalIndex:
+    """Validity ranges of a fetched dataset, for lookups by bisect instead of full scans.
+
+    ValidFrom/ValidTo are parsed once to dates and the entries are sorted on ValidFrom
+    (entries starting the same day keep their order). Like the string compare it
+    replaces, a range covers a day when ValidFrom <= day < ValidTo, an open ValidTo
+    covers every later day.
+
+    Open ended entries are kept apart, every one that started by the day covers it. The
+    closed entries are walked back from the day until none before can still cover it,
+    so a lookup costs the number of closed entries since the oldest one still running
+    on that day; a closed range spanning most of the dataset makes that close to linear.
+    """
+
+    def __init__(self, entries: Iterable[dict], valid_from: str = "ValidFrom", valid_to: str = "ValidTo") -> None:
+        parsed = sorted(
+            ((_as_date(entry[valid_from], date.min), _as_date(entry[valid_to], date.max), entry) for entry in entries),
+            key=lambda item: item[0],
+        )
+        # Position in the sorted order, to merge the closed and open ended entries back in that order
+        closed = [(position, start, end, entry) for position, (start, end, entry) in enumerate(parsed) if end != date.max]
+        opened = [(position, start, entry) for position, (start, end, entry) in enumerate(parsed) if end == date.max]
+        self._starts = [start for _, start, _, _ in closed]
+        self._ends = [end for _, _, end, _ in closed]
+        self._entries = [(position, entry) for position, _, _, entry in closed]
+        self._open_starts = [start for _, start, _ in opened]
+        self._open_entries = [(position, entry) for position, _, entry in opened]
+
+        # Highest end among the closed entries up to each position, tells when to stop walking back
+        self._max_ends = []
+        max_end = date.min
+        for end in self._ends:
+            max_end = max(max_end, end)
+            self._max_ends.append(max_end)
+
+    def __len__(self) -> int:
+        return len(self._entries) + len(self._open_entries)
+
+    def _walk_back(self, position: int, open_position: int, after: date) -> list[dict]:
+        """Closed entries before position that end after the given day and the open ended
+        entries before open_position, in index order."""
+        found = []
+        index = position - 1
+        while index >= 0 and self._max_ends[index] > after:
+            if self._ends[index] > after:
+                found.append(self._entries[index])
+            index -= 1
+        found.extend(self._open_entries[:open_position])
+        found.sort(key=lambda item: item[0])
+        return [entry for _, entry in found]
+
+    def covering(self, day: date | datetime | str) -> list[dict]:
+        """All entries valid on day, oldest ValidFrom first."""
+        day = _as_date(day, date.max)
+        return self._walk_back(bisect_right(self._starts, day), bisect_right(self._open_starts, day), day)
+
+    def overlapping(self, start: date | datetime | str, end: date | datetime | str | None) -> list[dict]:
+        """All entries valid on any day in [start, end), oldest ValidFrom first."""
+        start = _as_date(start, date.min)
+        end = _as_date(end, date.max)
+        return self._walk_back(bisect_left(self._starts, end), bisect_left(self._open_starts, end), start)
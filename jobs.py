@@ -0,0 +1,148 @@
+import asyncio
+from datetime import datetime, timedelta
+import json
+import logging
+from typing import Awaitable, Callable
+import uuid
+
+from models import Job
+from settings import connect_state_db, settings
+
+_logger = logging.getLogger(__name__)
+
+# Where job status is kept, read by the status route. Every instance of the app has its own
+# file unless STATE_DIR or JOBS_DB is on storage they share, so after a scale-out the status
+# of a job is only known to the instance that started it
+JOBS_DB = settings.jobs_db
+# A job still marked running after this many seconds is taken to have died with its host
+JOB_STALE_AFTER = settings.job_stale_after
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobStore:
+    """Status, stage timings and result of every sync job, in a SQLite file.
+
+    The store is per instance, see JOBS_DB. When the file cannot be written the jobs
+    are kept in memory for the life of the worker.
+    """
+
+    def __init__(self, path: str = JOBS_DB, stale_after: float = JOB_STALE_AFTER) -> None:
+        self.stale_after = timedelta(seconds=stale_after)
+        self._db = connect_state_db(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at TEXT NOT NULL,"
+            " started_at TEXT, finished_at TEXT, stages TEXT NOT NULL, result TEXT, error TEXT)"
+        )
+        self._db.commit()
+
+    def create(self) -> Job:
+        job = Job(id=uuid.uuid4().hex, status=QUEUED, created_at=datetime.now())
+        self.save(job)
+        return job
+
+    def save(self, job: Job) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO job (id, status, created_at, started_at, finished_at, stages, result, error)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.id, job.status, job.created_at.isoformat(),
+             job.started_at.isoformat() if job.started_at else None,
+             job.finished_at.isoformat() if job.finished_at else None,
+             json.dumps(job.stages), json.dumps(job.result) if job.result is not None else None, job.error),
+        )
+        self._db.commit()
+
+    def get(self, job_id: str) -> Job | None:
+        row = self._db.execute(
+            "SELECT id, status, created_at, started_at, finished_at, stages, result, error FROM job WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return Job(
+            id=row[0],
+            status=row[1],
+            created_at=datetime.fromisoformat(row[2]),
+            started_at=datetime.fromisoformat(row[3]) if row[3] else None,
+            finished_at=datetime.fromisoformat(row[4]) if row[4] else None,
+            stages=json.loads(row[5]),
+            result=json.loads(row[6]) if row[6] else None,
+            error=row[7],
+        )
+
+    def active(self) -> Job | None:
+        """The queued or running job, unless it went stale."""
+        cutoff = (datetime.now() - self.stale_after).isoformat()
+        row = self._db.execute(
+            "SELECT id FROM job WHERE status IN (?, ?) AND created_at >= ? ORDER BY created_at DESC LIMIT 1",
+            (QUEUED, RUNNING, cutoff),
+        ).fetchone()
+        return self.get(row[0]) if row else None
+
+    def close(self) -> None:
+        self._db.close()
+
+
+class JobProgress:
+    """Handed to the work of a job to report its stages and result."""
+
+    def __init__(self, store: JobStore, job: Job) -> None:
+        self.store = store
+        self.job = job
+
+    def stage(self, name: str, status: str, seconds: float | None = None) -> None:
+        self.job.stages[name] = {"status": status, "seconds": round(seconds, 3) if seconds is not None else None}
+        self.store.save(self.job)
+
+    def result(self, result: dict) -> None:
+        self.job.result = result
+        self.store.save(self.job)
+
+
+class InProcessQueue:
+    """Runs submitted jobs as background tasks on the running event loop.
+
+    This is what the HTTP trigger uses, and doubles as the local stand-in for a
+    queue trigger: join() waits until every submitted job has finished.
+    """
+
+    def __init__(self, store: JobStore) -> None:
+        self.store = store
+        self._tasks: set[asyncio.Task] = set()
+
+    def submit(self, work: Callable[[JobProgress], Awaitable[bool]]) -> tuple[Job, bool]:
+        """Start work as a new job, or return the job already in progress.
+
+        work returns False when the run failed without raising. The second value
+        tells if a new job was started.
+        """
+        active = self.store.active()
+        if active is not None:
+            return active, False
+        job = self.store.create()
+        task = asyncio.create_task(self._run(job, work))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job, True
+
+    async def _run(self, job: Job, work: Callable[[JobProgress], Awaitable[bool]]) -> None:
+        job.status = RUNNING
+        job.started_at = datetime.now()
+        self.store.save(job)
+        try:
+            ok = await work(JobProgress(self.store, job))
+            job.status = SUCCEEDED if ok else FAILED
+        except Exception as exc:
+            _logger.exception(f"Job {job.id} failed")
+            job.status = FAILED
+            job.error = repr(exc)
+        job.finished_at = datetime.now()
+        self.store.save(job)
+
+    async def join(self) -> None:
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
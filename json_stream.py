@@ -0,0 +1,144 @@
+from __future__ import annotations
+import codecs
+import json
+import re
+from typing import Any, AsyncIterator
+
+_SIGNIFICANT = re.compile(r'["{}\[\]:,]')
+_STRING_END = re.compile(r'["\\]')
+_SEPARATOR = re.compile(r"[\s,]*")
+
+
+class ArrayItemParser:
+    """Incremental parser for the items of one array in a JSON object, e.g. "records".
+
+    Text is fed in chunks as it arrives and every complete item is returned as soon as
+    its closing bracket is in, so only the current item is buffered. The members before
+    the array are skipped with a light scanner, everything after it is ignored.
+    """
+
+    def __init__(self, key: str) -> None:
+        self._key = json.dumps(key)
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = 0
+        self._last_string = None
+        self._key_matched = False
+        self.found = False
+        self.done = False
+
+    def feed(self, text: str) -> list[Any]:
+        """Add text and return the items completed by it."""
+        if self.done:
+            return []
+        self._buf += text
+        if not self.found:
+            self._seek()
+        items = self._items(final=False) if self.found else []
+        self._compact()
+        return items
+
+    def close(self) -> list[Any]:
+        """Return the last items once the stream ended, fail if the array was cut off."""
+        items = self._items(final=True) if self.found and not self.done else []
+        if self.found and not self.done:
+            raise ValueError("JSON stream ended inside the array")
+        return items
+
+    def _seek(self) -> None:
+        """Scan the top level object until the array of the key starts."""
+        buf = self._buf
+        pos = self._pos
+        while pos < len(buf):
+            if self._in_string:
+                match = _STRING_END.search(buf, pos)
+                if match is None:
+                    pos = len(buf)
+                    break
+                if match.group() == "\\":
+                    if match.end() >= len(buf):
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                self._in_string = False
+                pos = match.end()
+                if self._depth == 1:
+                    self._last_string = buf[self._string_start:pos]
+                continue
+
+            match = _SIGNIFICANT.search(buf, pos)
+            if match is None:
+                pos = len(buf)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                self._in_string = True
+                self._string_start = match.start()
+            elif char == ":":
+                self._key_matched = self._depth == 1 and self._last_string == self._key
+                self._last_string = None
+            elif char == "[" and self._key_matched and self._depth == 1:
+                self.found = True
+                self._pos = pos
+                return
+            elif char in "{[":
+                self._depth += 1
+                self._key_matched = False
+            elif char in "}]":
+                self._depth -= 1
+                self._key_matched = False
+            else:
+                self._key_matched = False
+                self._last_string = None
+        self._pos = pos
+
+    def _items(self, final: bool) -> list[Any]:
+        items = []
+        buf = self._buf
+        while True:
+            pos = _SEPARATOR.match(buf, self._pos).end()
+            if pos >= len(buf):
+                self._pos = pos
+                break
+            if buf[pos] == "]":
+                self.done = True
+                self._pos = pos + 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise
+                self._pos = pos  # The item is not complete yet
+                break
+            if end >= len(buf) and not final:
+                self._pos = pos  # A number may go on in the next chunk
+                break
+            items.append(item)
+            self._pos = end
+        return items
+
+    def _compact(self) -> None:
+        keep = self._string_start if self._in_string and not self.found else self._pos
+        if keep > 0:
+            self._buf = self._buf[keep:]
+            self._pos -= keep
+            self._string_start -= keep
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes], key: str) -> AsyncIterator[Any]:
+    """Yield the items of the key's array from a stream of UTF-8 encoded JSON."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    parser = ArrayItemParser(key)
+    async for chunk in chunks:
+        for item in parser.feed(decoder.decode(chunk)):
+            yield item
+        if parser.done:
+            return
+    for item in parser.feed(decoder.decode(b"", final=True)) + parser.close():
+        yield item
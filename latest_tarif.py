@@ -1,43 +1,39 @@
 import httpx
+from login import authorized_request
 import asyncio
-from dotenv import load_dotenv
-import os
 from models import Tarif
+from settings import settings
 
-load_dotenv()
-
-BASE_URL = os.getenv("BASE_URL")
+BASE_URL = settings.base_url
 
 async def get_latest_tarif(token: str) -> Tarif | None:
 
 
     url = f"{BASE_URL}/tarif/latest"
     headers = {
-        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
         "Accept": "application/json"
     }
 
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            print("Tarif retrieved successfully!")
-
-            data = response.json()
-            print(f"Tarif data: {data}")
-
-            my_tarif = Tarif(
-                valid_from=data.get("valid_from"),
-                valid_to=data.get("valid_to"),
-                nettarif=data.get("nettarif"),
-                systemtarif=data.get("systemtarif"),
-                includingVAT=data.get("includingVAT")
-            )
-
-            return my_tarif
-        except httpx.HTTPStatusError as e:
-            print(f"Tarif retrieval failed: {e}")
-            print("Response content:", e.response.text)
-            return None
\ No newline at end of file
+    try:
+        response = await authorized_request("GET", url, token, headers=headers)
+        response.raise_for_status()
+        print("Tarif retrieved successfully!")
+
+        data = response.json()
+        print(f"Tarif data: {data}")
+
+        my_tarif = Tarif(
+            valid_from=data.get("valid_from"),
+            valid_to=data.get("valid_to"),
+            nettarif=data.get("nettarif"),
+            systemtarif=data.get("systemtarif"),
+            includingVAT=data.get("includingVAT")
+        )
+
+        return my_tarif
+    except httpx.HTTPStatusError as e:
+        print(f"Tarif retrieval failed: {e}")
+        print("Response content:", e.response.text)
+        return None
\ No newline at end of file
@@ -1,42 +1,38 @@
 import httpx
+from login import authorized_request
 import asyncio
-from dotenv import load_dotenv
-import os
 from models import Tarif, Tax
+from settings import settings
 
-load_dotenv()
-
-BASE_URL = os.getenv("BASE_URL")
+BASE_URL = settings.base_url
 
 async def get_latest_tax(token: str) -> Tax | None:
 
 
     url = f"{BASE_URL}/tax/latest"
     headers = {
-        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
         "Accept": "application/json"
     }
 
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers)
-            response.raise_for_status()
-            print("Tax retrieved successfully!")
+    try:
+        response = await authorized_request("GET", url, token, headers=headers)
+        response.raise_for_status()
+        print("Tax retrieved successfully!")
 
-            data = response.json()
-            print(f"Tax data: {data}")
+        data = response.json()
+        print(f"Tax data: {data}")
 
-            my_tax  = Tax(
-                valid_from=data.get("valid_from"),
-                valid_to=data.get("valid_to"),
-                taxammount=data.get("taxammount"),
-                includingVAT=data.get("includingVAT")
-            )
+        my_tax  = Tax(
+            valid_from=data.get("valid_from"),
+            valid_to=data.get("valid_to"),
+            taxammount=data.get("taxammount"),
+            includingVAT=data.get("includingVAT")
+        )
 
-            return my_tax
-        except httpx.HTTPStatusError as e:
-            print(f"Tax retrieval failed: {e}")
-            print("Response content:", e.response.text)
-            return None
\ No newline at end of file
+        return my_tax
+    except httpx.HTTPStatusError as e:
+        print(f"Tax retrieval failed: {e}")
+        print("Response content:", e.response.text)
+        return None
\ No newline at end of file
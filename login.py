@@ -1,16 +1,23 @@
 import httpx
+from http_client import get_client
 import asyncio
-from dotenv import load_dotenv
-import os
+import base64
+import json
+import time
+from settings import settings
 
-load_dotenv()
-USER_NAME = os.getenv("USER_NAME")
-PASS_WORD = os.getenv("PASS_WORD")
-BASE_URL = os.getenv("BASE_URL")
+USER_NAME = settings.user_name
+PASS_WORD = settings.pass_word
+BASE_URL = settings.base_url
 
-async def login():
+# Refresh the token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = settings.token_refresh_margin
+# Lifetime assumed when neither the response nor the token tells
+TOKEN_DEFAULT_LIFETIME = settings.token_default_lifetime
 
 
+async def _login() -> tuple[str | None, float]:
+    """Log in and return the access token and when it expires."""
     url = f"{BASE_URL}/auth/login"
     headers = {
         "Content-Type": "application/x-www-form-urlencoded",
@@ -21,13 +28,99 @@ async def login():
         "password": PASS_WORD,
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, data=data, headers=headers)
-            response.raise_for_status()
-            print("Login successful!")
-            return response.json().get("access_token")
-        except httpx.HTTPStatusError as e:
-            print(f"Login failed: {e}")
-            print("Response content:", e.response.text)
-            return None
+    client = get_client()
+    try:
+        response = await client.post(url, data=data, headers=headers)
+        response.raise_for_status()
+        print("Login successful!")
+        body = response.json()
+    except httpx.HTTPStatusError as e:
+        print(f"Login failed: {e}")
+        print("Response content:", e.response.text)
+        return None, 0.0
+
+    token = body.get("access_token")
+    if body.get("expires_in"):
+        expires_at = time.time() + float(body["expires_in"])
+    else:
+        expires_at = jwt_expiry(token) or time.time() + TOKEN_DEFAULT_LIFETIME
+    return token, expires_at
+
+
+def jwt_expiry(token: str | None) -> float | None:
+    """Read the exp claim of a JWT, without verifying it."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenProvider:
+    """Caches the access token in the process and logs in again shortly before it expires.
+
+    Concurrent callers share one login.
+    """
+
+    def __init__(self, refresh_margin: int = TOKEN_REFRESH_MARGIN) -> None:
+        self.refresh_margin = refresh_margin
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._lock: asyncio.Lock | None = None
+        self._lock_loop: asyncio.AbstractEventLoop | None = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _is_valid(self) -> bool:
+        return self._token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    async def get_token(self) -> str | None:
+        """Return the cached token, logging in first when it is missing or about to expire."""
+        if self._is_valid():
+            return self._token
+        async with self._get_lock():
+            if not self._is_valid():
+                self._token, self._expires_at = await _login()
+            return self._token
+
+    async def refresh(self, stale_token: str | None) -> str | None:
+        """Replace a token the backend rejected.
+
+        When another caller already replaced it, the new token is returned without a login.
+        """
+        async with self._get_lock():
+            if self._token is None or self._token == stale_token:
+                self._token, self._expires_at = await _login()
+            return self._token
+
+    def invalidate(self) -> None:
+        self._token = None
+        self._expires_at = 0.0
+
+
+token_provider = TokenProvider()
+
+
+async def login():
+    """Return a valid access token, from the cache when possible."""
+    return await token_provider.get_token()
+
+
+async def authorized_request(method: str, url: str, token: str, headers: dict | None = None, **kwargs) -> httpx.Response:
+    """Send a request with the bearer token, logging in again once if it is rejected with 401."""
+    client = get_client()
+    headers = dict(headers or {})
+    headers["Authorization"] = f"Bearer {token}"
+    response = await client.request(method, url, headers=headers, **kwargs)
+    if response.status_code == 401:
+        fresh_token = await token_provider.refresh(token)
+        if fresh_token and fresh_token != token:
+            headers["Authorization"] = f"Bearer {fresh_token}"
+            response = await client.request(method, url, headers=headers, **kwargs)
+    return response
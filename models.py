@@ -1,6 +1,9 @@
-from dataclasses import dataclass
+from array import array
+from dataclasses import dataclass, field
 import datetime
+from math import fsum
 from typing import Union
+from zoneinfo import ZoneInfo
 
 @dataclass
 class Watermark():
@@ -31,51 +34,249 @@ class ChargeownerLatestCharge:
     is_checked: bool = False
 
 
-@dataclass
+HOURS = 24
+PRICE_KEYS = tuple(f"price{hour}" for hour in range(1, HOURS + 1))
+
+
+@dataclass(slots=True)
 class Charge:
+    """A charge with its 24 hourly prices in one array('d').
+
+    price1..price24 are still available as attributes and in the JSON payload.
+    """
     chargeowner_id: int
     charge_type: str
     charge_type_code: str
     note: str
     description: str
-    valid_from: datetime 
+    valid_from: datetime
     valid_to: datetime
-    price1: float
-    price2: float
-    price3: float
-    price4: float
-    price5: float
-    price6: float
-    price7: float
-    price8: float
-    price9: float
-    price10: float
-    price11: float
-    price12: float
-    price13: float
-    price14: float
-    price15: float
-    price16: float
-    price17: float
-    price18: float
-    price19: float
-    price20: float
-    price21: float
-    price22: float
-    price23: float
-    price24: float
+    prices: array = field(default_factory=lambda: array("d", bytes(8 * HOURS)))
 
-@dataclass
+    def __post_init__(self):
+        if not isinstance(self.prices, array) or self.prices.typecode != "d":
+            self.prices = array("d", (0.0 if price is None else price for price in self.prices))
+        if len(self.prices) != HOURS:
+            raise ValueError(f"A charge needs {HOURS} hourly prices, got {len(self.prices)}")
+
+    def to_payload(self) -> dict:
+        """The JSON payload of the backend, with price1..price24."""
+        payload = {
+            "chargeowner_id": self.chargeowner_id,
+            "charge_type": self.charge_type,
+            "charge_type_code": self.charge_type_code,
+            "note": self.note,
+            "description": self.description,
+            "valid_from": self.valid_from.isoformat() if isinstance(self.valid_from, datetime.datetime) else self.valid_from,
+            "valid_to": self.valid_to.isoformat() if isinstance(self.valid_to, datetime.datetime) else self.valid_to,
+        }
+        payload.update(zip(PRICE_KEYS, self.prices))
+        return payload
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "Charge":
+        """Build a charge from a backend payload with price1..price24."""
+        return cls(
+            chargeowner_id=payload.get("chargeowner_id"),
+            charge_type=payload.get("charge_type"),
+            charge_type_code=payload.get("charge_type_code"),
+            note=payload.get("note"),
+            description=payload.get("description"),
+            valid_from=_parse_datetime(payload.get("valid_from")),
+            valid_to=_parse_datetime(payload.get("valid_to")),
+            prices=[payload.get(key, 0.0) for key in PRICE_KEYS],
+        )
+
+
+def _parse_datetime(value):
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+def _price_property(index: int) -> property:
+    def getter(charge: Charge) -> float:
+        return charge.prices[index]
+
+    def setter(charge: Charge, value: float) -> None:
+        charge.prices[index] = value
+
+    return property(getter, setter)
+
+
+for _index, _key in enumerate(PRICE_KEYS):
+    setattr(Charge, _key, _price_property(_index))
+
+@dataclass(slots=True)
 class Tax:
     valid_from: datetime
     valid_to: datetime
     taxammount: float
     includingVAT: bool
 
-@dataclass
+@dataclass(slots=True)
 class Tarif:
     valid_from: datetime
     valid_to: datetime
     nettarif: float
     systemtarif: float
-    includingVAT: bool
\ No newline at end of file
+    includingVAT: bool
+
+# Delivery days of the day-ahead market follow Danish local time
+MARKET_TIMEZONE = ZoneInfo("Europe/Copenhagen")
+
+
+def delivery_day_bounds(delivery_date: datetime.date) -> tuple[datetime.datetime, datetime.datetime]:
+    """Start and end of a delivery day in UTC, 23 or 25 hours apart on DST changes."""
+    start = datetime.datetime.combine(delivery_date, datetime.time(), MARKET_TIMEZONE)
+    end = datetime.datetime.combine(delivery_date + datetime.timedelta(days=1), datetime.time(), MARKET_TIMEZONE)
+    return start.astimezone(datetime.timezone.utc), end.astimezone(datetime.timezone.utc)
+
+
+@dataclass(slots=True)
+class SpotPriceSeries:
+    """Day-ahead prices of one delivery area for one delivery day.
+
+    The intervals follow each other from start (UTC) with a fixed resolution in
+    minutes, prices holds one value per interval: 24 hourly or 96 quarter-hourly
+    prices on a normal day, 23/92 and 25/100 on the DST change days.
+    """
+    area: str
+    delivery_date: datetime.date
+    start: datetime.datetime
+    resolution: int
+    currency: str
+    prices: array = field(default_factory=lambda: array("d"))
+
+    def __post_init__(self):
+        if not isinstance(self.prices, array) or self.prices.typecode != "d":
+            self.prices = array("d", self.prices)
+
+    @property
+    def end(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(minutes=self.resolution * len(self.prices))
+
+    def expected_intervals(self) -> int:
+        """Number of intervals in the delivery day at this resolution."""
+        start, end = delivery_day_bounds(self.delivery_date)
+        return int((end - start).total_seconds() // 60) // self.resolution
+
+    def is_complete(self) -> bool:
+        """True when the prices cover exactly the delivery day."""
+        return (self.start == delivery_day_bounds(self.delivery_date)[0]
+                and len(self.prices) == self.expected_intervals())
+
+    def price_at(self, moment: datetime.datetime) -> float | None:
+        """The price of the interval holding moment (timezone aware), None outside the day."""
+        index = int((moment - self.start).total_seconds() // 60) // self.resolution
+        if 0 <= index < len(self.prices) and moment >= self.start:
+            return self.prices[index]
+        return None
+
+    def resample(self, resolution: int) -> "SpotPriceSeries":
+        """The series at another resolution.
+
+        Coarser intervals get the mean of the intervals they contain, finer intervals
+        repeat the price of the interval they are part of.
+        """
+        if resolution == self.resolution:
+            prices = array("d", self.prices)
+        elif resolution > self.resolution:
+            if resolution % self.resolution:
+                raise ValueError(f"Cannot aggregate {self.resolution} minute prices to {resolution} minutes")
+            factor = resolution // self.resolution
+            chunks = (self.prices[i:i + factor] for i in range(0, len(self.prices), factor))
+            prices = array("d", (fsum(chunk) / len(chunk) for chunk in chunks))
+        else:
+            if self.resolution % resolution:
+                raise ValueError(f"Cannot split {self.resolution} minute prices in {resolution} minutes")
+            factor = self.resolution // resolution
+            prices = array("d")
+            for price in self.prices:
+                prices.extend((price,) * factor)
+        return SpotPriceSeries(self.area, self.delivery_date, self.start, resolution, self.currency, prices)
+
+    def to_hourly(self) -> "SpotPriceSeries":
+        return self.resample(60)
+
+    def to_quarter_hourly(self) -> "SpotPriceSeries":
+        return self.resample(15)
+
+    def to_payload(self) -> dict:
+        """The compact JSON payload of the backend."""
+        return {
+            "area": self.area,
+            "delivery_date": self.delivery_date.isoformat(),
+            "start": self.start.isoformat(),
+            "resolution_minutes": self.resolution,
+            "currency": self.currency,
+            "prices": self.prices.tolist(),
+        }
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "SpotPriceSeries":
+        return cls(
+            area=payload["area"],
+            delivery_date=datetime.date.fromisoformat(payload["delivery_date"]),
+            start=datetime.datetime.fromisoformat(payload["start"]),
+            resolution=int(payload["resolution_minutes"]),
+            currency=payload["currency"],
+            prices=payload["prices"],
+        )
+
+@dataclass
+class ChargeSyncSummary:
+    # Chargeowners by id, owners can share a GLN number
+    synced: list[int] = field(default_factory=list)
+    skipped: list[int] = field(default_factory=list)
+    failed: dict[int, str] = field(default_factory=dict)
+    inserted: int = 0
+    duration: float = 0.0
+
+@dataclass
+class OwnerSyncState:
+    owner_id: int
+    last_checked: datetime.datetime
+    fingerprint: str
+    next_probe: datetime.datetime
+    interval: float
+
+@dataclass
+class BackfillSummary:
+    done: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    inserted: int = 0
+    duration: float = 0.0
+
+@dataclass
+class RunReport:
+    completed: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)
+    backlog: list[str] = field(default_factory=list)
+    timings: dict[str, float] = field(default_factory=dict)
+    results: dict[str, object] = field(default_factory=dict)
+    duration: float = 0.0
+
+@dataclass
+class Job:
+    id: str
+    status: str
+    created_at: datetime.datetime
+    started_at: Union[None, datetime.datetime] = None
+    finished_at: Union[None, datetime.datetime] = None
+    stages: dict[str, dict] = field(default_factory=dict)
+    result: Union[None, dict] = None
+    error: Union[None, str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "stages": self.stages,
+            "result": self.result,
+            "error": self.error,
+        }
@@ -0,0 +1,95 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Iterable
+
+PRICE_FIELDS = tuple(f"Price{i}" for i in range(1, 25))
+META_FIELDS = ("ValidFrom", "ValidTo", "Note", "Description", "ChargeType", "ChargeTypeCode")
+
+# Keys of the tariff data format used by Connector and insert_charge
+TARIFF_PRICE_KEYS = tuple(f"price{i}" for i in range(24))
+
+
+@dataclass(slots=True)
+class DecodedEntry:
+    valid_from: str
+    valid_to: str | None
+    note: str
+    description: str
+    charge_type: str
+    charge_type_code: str
+    prices: list[float]
+
+    def as_tariff(self) -> dict:
+        """Return the entry in the tariff data format, price0..price23 plus the metadata."""
+        tariff_data = dict(zip(TARIFF_PRICE_KEYS, self.prices))
+        tariff_data.update({
+            "ValidFrom": self.valid_from,
+            "ValidTo": self.valid_to,
+            "Note": self.note,
+            "Description": self.description,
+            "ChargeType": self.charge_type,
+            "ChargeTypeCode": self.charge_type_code,
+        })
+        return tariff_data
+
+
+class PricelistDecoder:
+    """Decoder for DatahubPricelist records, compiled once from the dataset's field list.
+
+    Price1..Price24 are read straight into a 24 slot list, a missing (null) hourly
+    price takes the value of Price1 like the daily tariffs in the dataset expect.
+    """
+
+    def __init__(self, field_names: Iterable[str]) -> None:
+        names = set(field_names)
+        self.complete = all(field in names for field in PRICE_FIELDS + META_FIELDS)
+        self._prices = itemgetter(*PRICE_FIELDS)
+        self._meta = itemgetter(*META_FIELDS)
+
+    @classmethod
+    def from_fields(cls, fields: list[dict]) -> "PricelistDecoder":
+        """Compile from the "fields" metadata of an Energi Data Service response."""
+        return cls(field["name"] for field in fields)
+
+    def _read(self, record: dict) -> tuple[list, tuple] | None:
+        if not self.complete:
+            return None
+        try:
+            prices = self._prices(record)
+            meta = self._meta(record)
+        except KeyError:
+            return None
+        if None in prices:
+            baseprice = prices[0]
+            prices = [baseprice if price is None else price for price in prices]
+        else:
+            prices = list(prices)
+        return prices, meta
+
+    def decode(self, record: dict) -> DecodedEntry | None:
+        """Decode one record, None when it lacks any of the fields."""
+        read = self._read(record)
+        if read is None:
+            return None
+        prices, meta = read
+        return DecodedEntry(*meta, prices)
+
+    def decode_tariff(self, record: dict) -> dict | None:
+        """Decode one record straight to the tariff data format."""
+        read = self._read(record)
+        if read is None:
+            return None
+        prices, meta = read
+        tariff_data = dict(zip(TARIFF_PRICE_KEYS, prices))
+        tariff_data.update(zip(META_FIELDS, meta))
+        return tariff_data
+
+    def decode_page(self, records: Iterable[dict]) -> list[DecodedEntry]:
+        """Decode a whole page, records with missing fields are left out."""
+        decode = self.decode
+        return [entry for entry in map(decode, records) if entry is not None]
+
+
+# Decoder for the documented DatahubPricelist fields
+DATAHUB_PRICELIST_DECODER = PricelistDecoder(PRICE_FIELDS + META_FIELDS)
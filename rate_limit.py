@@ -0,0 +1,194 @@
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import logging
+import random
+import time
+from typing import Awaitable, Callable
+
+import httpx
+from settings import settings
+
+_logger = logging.getLogger(__name__)
+
+# Requests per second to start at, the limiter moves between the min and max rate
+EDS_RATE = settings.eds_rate
+EDS_MIN_RATE = settings.eds_min_rate
+EDS_MAX_RATE = settings.eds_max_rate
+NORDPOOL_RATE = settings.nordpool_rate
+NORDPOOL_MIN_RATE = settings.nordpool_min_rate
+NORDPOOL_MAX_RATE = settings.nordpool_max_rate
+
+# Attempts per request and the longest single wait between them
+RETRY_MAX_ATTEMPTS = settings.retry_max_attempts
+RETRY_BASE_DELAY = settings.retry_base_delay
+RETRY_MAX_DELAY = settings.retry_max_delay
+# Retries all callers of one API may spend together, every success earns back a tenth of one
+RETRY_BUDGET = settings.retry_budget
+
+# Responses worth another attempt, 429 and 503 also lower the rate
+RETRY_STATUS = {429, 500, 502, 503, 504}
+THROTTLE_STATUS = {429, 503}
+
+
+class RetryError(Exception):
+    """A request still failed when its attempts or the shared retry budget ran out."""
+
+
+class StatusError(RetryError):
+    """A request failed with a status another attempt would not change, e.g. 400."""
+
+    def __init__(self, message: str, status_code: int) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait from a Retry-After header, given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryBudget:
+    """Retries shared by all callers, refilled a little by every successful request."""
+
+    def __init__(self, size: float = RETRY_BUDGET, per_success: float = 0.1) -> None:
+        self.size = size
+        self.per_success = per_success
+        self.tokens = size
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def deposit(self) -> None:
+        self.tokens = min(self.size, self.tokens + self.per_success)
+
+
+class RateLimiter:
+    """Adaptive token bucket for one API, shared by every request to it.
+
+    The rate grows a little after each success and is halved on 429/503. A Retry-After
+    header pauses all callers until it has passed, for at most max_delay; a request told
+    to wait longer fails at once instead of holding up the run. Failed requests are
+    retried with jittered exponential backoff as long as the shared retry budget allows.
+    """
+
+    def __init__(self, name: str, rate: float, min_rate: float, max_rate: float,
+                 max_attempts: int = RETRY_MAX_ATTEMPTS, base_delay: float = RETRY_BASE_DELAY,
+                 max_delay: float = RETRY_MAX_DELAY, budget: RetryBudget | None = None) -> None:
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget or RetryBudget()
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock: asyncio.Lock | None = None
+        self._lock_loop: asyncio.AbstractEventLoop | None = None
+        self.throttled = 0
+        self.retries = 0
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Wait for a free slot at the current rate."""
+        async with self._get_lock():
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + 0.1)
+        self.budget.deposit()
+
+    def on_throttle(self, retry_after: float | None) -> None:
+        self.throttled += 1
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = min(self._tokens, 0.0)
+        # A long Retry-After must not park every caller, the request asking is given up instead
+        pause = min(self.max_delay, retry_after) if retry_after else 0.0
+        if pause:
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+        _logger.warning(f"{self.name} throttled, rate lowered to {self.rate:.2f}/s"
+                        + (f", paused {pause:.1f}s" if pause else ""))
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """Seconds to wait before the next attempt, with full jitter."""
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Send a request through the limiter, retrying transport errors and RETRY_STATUS responses."""
+        attempt = 0
+        while True:
+            await self.acquire()
+            retry_after = None
+            try:
+                response = await send()
+            except httpx.TransportError as exc:
+                error = repr(exc)
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    self.on_success()
+                    return response
+                error = f"status {response.status_code}"
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if response.status_code in THROTTLE_STATUS:
+                    self.on_throttle(retry_after)
+                await response.aclose()
+
+            attempt += 1
+            if attempt >= self.max_attempts:
+                raise RetryError(f"{self.name} request failed after {attempt} attempts: {error}")
+            if retry_after is not None and retry_after > self.max_delay:
+                raise RetryError(f"{self.name} asked to retry after {retry_after:.0f}s, over {self.max_delay:.0f}s: {error}")
+            if not self.budget.withdraw():
+                raise RetryError(f"{self.name} retry budget exhausted: {error}")
+            self.retries += 1
+            delay = self.backoff(attempt, retry_after)
+            _logger.info(f"{self.name} request failed ({error}), retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"rate": round(self.rate, 2), "throttled": self.throttled, "retries": self.retries,
+                "budget": round(self.budget.tokens, 1)}
+
+
+eds_limiter = RateLimiter("Energi Data Service", EDS_RATE, EDS_MIN_RATE, EDS_MAX_RATE)
+nordpool_limiter = RateLimiter("Nord Pool", NORDPOOL_RATE, NORDPOOL_MIN_RATE, NORDPOOL_MAX_RATE)
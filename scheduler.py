@@ -0,0 +1,149 @@
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from models import RunReport
+from settings import connect_state_db, settings
+
+_logger = logging.getLogger(__name__)
+
+# Seconds one invocation may spend, below the functionTimeout of the host (5 minutes by default)
+RUN_TIME_BUDGET = settings.run_time_budget
+# Seconds kept free at the end for flushing the writers
+RUN_TIME_MARGIN = settings.run_time_margin
+# Durations of earlier units and the backlog left by the last run
+SCHEDULER_DB = settings.scheduler_db
+
+# Seconds per item assumed for a kind of unit that has not run before
+DEFAULT_ITEM_COST = {"charges": 0.5, "system_tariffs": 5.0, "spotprices": 2.0}
+# Weight of the latest run in the duration estimate
+COST_SMOOTHING = 0.3
+
+
+@dataclass
+class WorkUnit:
+    name: str
+    kind: str
+    run: Callable[[], Awaitable[Any]]
+    priority: int = 0
+    size: int = 1
+    stale_since: datetime | None = None
+
+
+class Scheduler:
+    """Runs work units within a time budget, most urgent first.
+
+    Units are ordered on priority, then on how long their data has been waiting.
+    A unit is only started when its estimated duration, learned per kind from
+    earlier runs, fits in the time left; the first unit of a run always starts so
+    an underestimated budget still makes progress. A unit still running at the
+    deadline is stopped. Units that did not fit are recorded as backlog and count
+    as waiting since then in the next run.
+    """
+
+    def __init__(self, budget: float = RUN_TIME_BUDGET, margin: float = RUN_TIME_MARGIN,
+                 path: str = SCHEDULER_DB) -> None:
+        self.deadline = time.monotonic() + budget - margin
+        self._db = connect_state_db(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS unit_cost ("
+            " kind TEXT PRIMARY KEY, item_seconds REAL NOT NULL, runs INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS backlog (name TEXT PRIMARY KEY, since TEXT NOT NULL)"
+        )
+        self._db.commit()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def estimate(self, unit: WorkUnit) -> float:
+        """Expected seconds for the unit, from the durations of its kind so far."""
+        row = self._db.execute("SELECT item_seconds FROM unit_cost WHERE kind = ?", (unit.kind,)).fetchone()
+        item_seconds = row[0] if row else DEFAULT_ITEM_COST.get(unit.kind, 1.0)
+        return item_seconds * max(1, unit.size)
+
+    def _learn(self, unit: WorkUnit, duration: float) -> None:
+        item_seconds = duration / max(1, unit.size)
+        row = self._db.execute("SELECT item_seconds, runs FROM unit_cost WHERE kind = ?", (unit.kind,)).fetchone()
+        if row:
+            item_seconds = (1 - COST_SMOOTHING) * row[0] + COST_SMOOTHING * item_seconds
+        self._db.execute(
+            "INSERT OR REPLACE INTO unit_cost (kind, item_seconds, runs) VALUES (?, ?, ?)",
+            (unit.kind, item_seconds, (row[1] if row else 0) + 1),
+        )
+        self._db.commit()
+
+    def _waiting_since(self, unit: WorkUnit, now: datetime) -> datetime:
+        row = self._db.execute("SELECT since FROM backlog WHERE name = ?", (unit.name,)).fetchone()
+        candidates = [now]
+        if unit.stale_since is not None:
+            candidates.append(unit.stale_since)
+        if row:
+            candidates.append(datetime.fromisoformat(row[0]))
+        return min(candidates)
+
+    def order(self, units: list[WorkUnit]) -> list[WorkUnit]:
+        """Units by priority, the longest waiting first within a priority."""
+        now = datetime.now()
+        return sorted(units, key=lambda unit: (unit.priority, self._waiting_since(unit, now)))
+
+    async def run(self, units: list[WorkUnit],
+                  progress: Callable[[str, str, float | None], None] | None = None) -> RunReport:
+        """Run the units, progress is told the name, status and duration of each unit."""
+        report = RunReport()
+        progress = progress or (lambda name, status, seconds: None)
+        started = time.monotonic()
+        now = datetime.now()
+
+        for unit in self.order(units):
+            estimate = self.estimate(unit)
+            # The first unit always starts, the deadline still stops it
+            if estimate > self.remaining() and report.timings:
+                _logger.info(f"Not starting {unit.name}, estimated {estimate:.1f}s with {self.remaining():.1f}s left")
+                report.backlog.append(unit.name)
+                progress(unit.name, "backlog", None)
+                continue
+
+            unit_started = time.monotonic()
+            progress(unit.name, "running", None)
+            try:
+                # A unit running over its estimate is stopped at the deadline
+                report.results[unit.name] = await asyncio.wait_for(unit.run(), timeout=max(0.0, self.remaining()))
+            except asyncio.TimeoutError:
+                report.timings[unit.name] = time.monotonic() - unit_started
+                _logger.warning(f"{unit.name} stopped at the deadline")
+                report.backlog.append(unit.name)
+                progress(unit.name, "stopped", report.timings[unit.name])
+                continue
+            except Exception as exc:
+                report.timings[unit.name] = time.monotonic() - unit_started
+                _logger.exception(f"{unit.name} failed")
+                report.failed[unit.name] = repr(exc)
+                progress(unit.name, "failed", report.timings[unit.name])
+                continue
+
+            report.timings[unit.name] = time.monotonic() - unit_started
+            self._learn(unit, report.timings[unit.name])
+            report.completed.append(unit.name)
+            progress(unit.name, "done", report.timings[unit.name])
+
+        self._save_backlog(report.backlog, now)
+        report.duration = time.monotonic() - started
+        return report
+
+    def _save_backlog(self, names: list[str], now: datetime) -> None:
+        """Keep the first time each unit was left over, forget the ones that ran."""
+        previous = dict(self._db.execute("SELECT name, since FROM backlog").fetchall())
+        self._db.execute("DELETE FROM backlog")
+        self._db.executemany(
+            "INSERT INTO backlog (name, since) VALUES (?, ?)",
+            [(name, previous.get(name, now.isoformat())) for name in names],
+        )
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,200 @@
+"""
+Configuration of the function app, read once from the environment and .env.
+
+Every module takes its settings from `settings` instead of calling load_dotenv and
+os.getenv itself, so the .env file is searched and parsed once per worker. The
+modules keep their constants, e.g. backend_writer.MAX_IN_FLIGHT, with the comment
+saying what they do.
+"""
+from dataclasses import dataclass
+import logging
+import os
+import sqlite3
+import tempfile
+
+from dotenv import load_dotenv
+
+_logger = logging.getLogger(__name__)
+
+
+def _str(name: str, default: str | None = None) -> str | None:
+    return os.getenv(name, default)
+
+
+def _int(name: str, default: int) -> int:
+    return int(os.getenv(name) or default)
+
+
+def _float(name: str, default: float) -> float:
+    return float(os.getenv(name) or default)
+
+
+def _bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return default if value is None else value.lower() == "true"
+
+
+@dataclass(frozen=True)
+class Settings:
+    # HEADS backend
+    base_url: str | None
+    user_name: str | None
+    pass_word: str | None
+    token_refresh_margin: int
+    token_default_lifetime: int
+
+    # Stages of a sync run
+    job_mode: bool
+    bulk_upload: bool
+    charge_sync_concurrency: int
+    sync_state: bool
+    charge_unit_size: int
+    run_time_budget: float
+    run_time_margin: float
+
+    # Shared HTTP client
+    http_max_connections: int
+    http_max_keepalive_connections: int
+    http_keepalive_expiry: float
+    http_timeout: float
+    http_connect_timeout: float
+    http_accept_encoding: str
+
+    # Backend writes
+    backend_max_in_flight: int
+    backend_batch_size: int
+    backend_batch_flush_interval: float
+    backend_compression: str
+    backend_compression_min_bytes: int
+    backend_compression_level: int
+    backend_dedup: bool
+    backend_dedup_db: str
+    backend_dedup_max_age_days: float
+
+    # Energi Data Service
+    eds_page_size: int
+    eds_cache_ttl: float
+    eds_cache_max_entries: int
+    eds_cache_max_records: int
+    eds_cache_max_page_records: int
+    eds_cache_dir: str | None
+    eds_cache_max_bytes: int
+
+    # Rate limits and retries
+    eds_rate: float
+    eds_min_rate: float
+    eds_max_rate: float
+    nordpool_rate: float
+    nordpool_min_rate: float
+    nordpool_max_rate: float
+    retry_max_attempts: int
+    retry_base_delay: float
+    retry_max_delay: float
+    retry_budget: float
+
+    # Spot prices
+    spotprice_concurrency: int
+    spotprice_upload_format: str
+    spotprice_upload_resolution: int
+
+    # State kept between runs
+    state_dir: str
+    scheduler_db: str
+    sync_state_db: str
+    sync_state_min_interval: float
+    sync_state_max_interval: float
+    jobs_db: str
+    job_stale_after: float
+    backfill_checkpoint: str
+    backfill_partition_days: int
+    backfill_concurrency: int
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        load_dotenv()
+        # The working directory is read-only when the app runs from a package, so all SQLite
+        # stores live in the temp directory unless STATE_DIR points elsewhere, e.g. /home/data/heads
+        state_dir = _str("STATE_DIR") or os.path.join(tempfile.gettempdir(), "heads")
+        return cls(
+            base_url=_str("BASE_URL"),
+            user_name=_str("USER_NAME"),
+            pass_word=_str("PASS_WORD"),
+            token_refresh_margin=_int("TOKEN_REFRESH_MARGIN", 60),
+            token_default_lifetime=_int("TOKEN_DEFAULT_LIFETIME", 900),
+            job_mode=_bool("JOB_MODE", True),
+            bulk_upload=_bool("BACKEND_BULK_UPLOAD", True),
+            charge_sync_concurrency=_int("CHARGE_SYNC_CONCURRENCY", 8),
+            sync_state=_bool("SYNC_STATE", True),
+            charge_unit_size=_int("CHARGE_UNIT_SIZE", 25),
+            run_time_budget=_float("RUN_TIME_BUDGET", 240),
+            run_time_margin=_float("RUN_TIME_MARGIN", 15),
+            http_max_connections=_int("HTTP_MAX_CONNECTIONS", 100),
+            http_max_keepalive_connections=_int("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20),
+            http_keepalive_expiry=_float("HTTP_KEEPALIVE_EXPIRY", 60),
+            http_timeout=_float("HTTP_TIMEOUT", 30),
+            http_connect_timeout=_float("HTTP_CONNECT_TIMEOUT", 10),
+            http_accept_encoding=_str("HTTP_ACCEPT_ENCODING", "gzip, deflate"),
+            backend_max_in_flight=_int("BACKEND_MAX_IN_FLIGHT", 16),
+            backend_batch_size=_int("BACKEND_BATCH_SIZE", 200),
+            backend_batch_flush_interval=_float("BACKEND_BATCH_FLUSH_INTERVAL", 2.0),
+            backend_compression=_str("BACKEND_COMPRESSION", "none").lower(),
+            backend_compression_min_bytes=_int("BACKEND_COMPRESSION_MIN_BYTES", 1024),
+            backend_compression_level=_int("BACKEND_COMPRESSION_LEVEL", 6),
+            backend_dedup=_bool("BACKEND_DEDUP", True),
+            backend_dedup_db=_str("BACKEND_DEDUP_DB") or os.path.join(state_dir, "write_hashes.sqlite"),
+            backend_dedup_max_age_days=_float("BACKEND_DEDUP_MAX_AGE_DAYS", 7),
+            eds_page_size=_int("EDS_PAGE_SIZE", 1000),
+            eds_cache_ttl=_float("EDS_CACHE_TTL", 3600),
+            eds_cache_max_entries=_int("EDS_CACHE_MAX_ENTRIES", 256),
+            eds_cache_max_records=_int("EDS_CACHE_MAX_RECORDS", 10000),
+            eds_cache_max_page_records=_int("EDS_CACHE_MAX_PAGE_RECORDS", 500),
+            eds_cache_dir=_str("EDS_CACHE_DIR"),
+            eds_cache_max_bytes=_int("EDS_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+            eds_rate=_float("EDS_RATE", 5),
+            eds_min_rate=_float("EDS_MIN_RATE", 0.2),
+            eds_max_rate=_float("EDS_MAX_RATE", 20),
+            nordpool_rate=_float("NORDPOOL_RATE", 2),
+            nordpool_min_rate=_float("NORDPOOL_MIN_RATE", 0.1),
+            nordpool_max_rate=_float("NORDPOOL_MAX_RATE", 10),
+            retry_max_attempts=_int("RETRY_MAX_ATTEMPTS", 6),
+            retry_base_delay=_float("RETRY_BASE_DELAY", 1),
+            retry_max_delay=_float("RETRY_MAX_DELAY", 60),
+            retry_budget=_float("RETRY_BUDGET", 30),
+            spotprice_concurrency=_int("SPOTPRICE_CONCURRENCY", 4),
+            spotprice_upload_format=_str("SPOTPRICE_UPLOAD_FORMAT", "raw").lower(),
+            spotprice_upload_resolution=_int("SPOTPRICE_UPLOAD_RESOLUTION", 0),
+            state_dir=state_dir,
+            scheduler_db=_str("SCHEDULER_DB") or os.path.join(state_dir, "scheduler.sqlite"),
+            sync_state_db=_str("SYNC_STATE_DB") or os.path.join(state_dir, "sync_state.sqlite"),
+            sync_state_min_interval=_float("SYNC_STATE_MIN_INTERVAL", 6 * 3600),
+            sync_state_max_interval=_float("SYNC_STATE_MAX_INTERVAL", 48 * 3600),
+            jobs_db=_str("JOBS_DB") or os.path.join(state_dir, "jobs.sqlite"),
+            job_stale_after=_float("JOB_STALE_AFTER", 900),
+            backfill_checkpoint=_str("BACKFILL_CHECKPOINT") or os.path.join(state_dir, "backfill.sqlite"),
+            backfill_partition_days=_int("BACKFILL_PARTITION_DAYS", 30),
+            backfill_concurrency=_int("BACKFILL_CONCURRENCY", 4),
+        )
+
+    def require_base_url(self) -> str:
+        if not self.base_url:
+            raise ValueError("BASEURL environment variable is not set. Please check your .env file.")
+        return self.base_url
+
+
+def connect_state_db(path: str) -> sqlite3.Connection:
+    """Open a SQLite store, in memory for this process when the file cannot be written."""
+    try:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        db = sqlite3.connect(path)
+        # Write the header once, a read-only file or directory fails here instead of on the first write
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        db.execute(f"PRAGMA user_version = {version}")
+        db.commit()
+        return db
+    except (OSError, sqlite3.Error) as exc:
+        _logger.warning(f"Cannot open {path} ({exc}), keeping its state in memory for this process")
+        return sqlite3.connect(":memory:")
+
+
+settings = Settings.from_env()
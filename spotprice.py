@@ -1,12 +1,15 @@
 import asyncio
+from contextlib import AsyncExitStack
 from logging import getLogger
 import logging
-import os
 import sys
-from dotenv import load_dotenv
-import requests
+from backend_writer import BackendWriter, BatchWriter, post
+from http_client import get_client
 from login import login
-from datetime import datetime, timedelta
+from models import SpotPriceSeries
+from rate_limit import nordpool_limiter
+from datetime import date, datetime, timedelta
+from settings import settings
 
 
 _logger = getLogger(__name__)
@@ -17,15 +20,21 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)]
 )
 
-load_dotenv()
+BASE_URL = settings.require_base_url()
 
-BASE_URL = os.getenv("BASE_URL")
-if not BASE_URL:
-    raise ValueError("BASEURL environment variable is not set. Please check your .env file.")
+# Days fetched from Nord Pool at the same time
+SPOTPRICE_CONCURRENCY = settings.spotprice_concurrency
+NORDPOOL_AREAS = ("DK1", "DK2")
+# "raw" forwards the Nord Pool response to /spotprice/nordpool, "compact" uploads one SpotPriceSeries per
+# area to /spotprice/series once the backend has that endpoint
+SPOTPRICE_UPLOAD_FORMAT = settings.spotprice_upload_format
+# Resolution in minutes of the uploaded series, e.g. 60 for a backend that only stores hourly
+# prices. Empty keeps the resolution Nord Pool delivers, 15 minutes since the market moved to it.
+SPOTPRICE_UPLOAD_RESOLUTION = settings.spotprice_upload_resolution
 
 
 
-def get_nordpool_spotprices(date = None):
+async def get_nordpool_spotprices(date = None):
     """
     Fetches the Nord Pool spot prices from the API.
     """
@@ -40,17 +49,20 @@ def get_nordpool_spotprices(date = None):
 
     headers = {}
 
-    response = requests.get(url, headers=headers)
+    client = get_client()
+    response = await nordpool_limiter.call(lambda: client.get(url, headers=headers))
 
     if response.status_code == 200:
         _logger.info("Nord Pool spot prices fetched successfully.")
+    elif response.status_code == 204:
+        _logger.info(f"No Nord Pool spot prices published for {date} yet.")
     else:
         _logger.error(f"Failed to fetch Nord Pool spot prices: {response.status_code} - {response.text}")
 
     return response
 
 
-def upload(token,prices):
+async def upload(token,prices, writer: BackendWriter | BatchWriter | None = None):
     """
     Uploads the fetched prices to the database.
     """
@@ -60,23 +72,145 @@ def upload(token,prices):
     # For now, we just log the prices
     _logger.debug(f"Prices: {prices}")
 
-    url = f"{BASE_URL}/spotprice/nordpool"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Content-Type": "application/json"
-    }
     tarif_payload = prices
-    response = requests.post(url, headers=headers, json=tarif_payload)
-    if response.status_code == 200:
-        _logger.info("pricedata sent successfully.")
+    response = await post("/spotprice/nordpool", tarif_payload, token, writer)
+    if response is None:
+        _logger.info("pricedata queued for bulk upload.")
+    elif response.skipped:
+        _logger.info("pricedata unchanged, not sent.")
+    elif response.status_code == 200:
+        _logger.info(f"pricedata sent successfully in {response.latency * 1000:.0f} ms.")
     else:
         _logger.error(f"Failed to send pricedata: {response.status_code} - {response.text}")
 
 
 
 
-async def insert_spotprices(spotdate: datetime, token):
-    _logger.info(f"Processing date: {spotdate}")
-    prices = get_nordpool_spotprices(spotdate)
-    upload(token, prices.json())
+def validate_spotprices(payload, spotdate) -> list[str]:
+    """Problems found in a DayAheadPrices response for spotdate, empty when it is usable."""
+    if not isinstance(payload, dict):
+        return ["response is not an object"]
+    problems = []
+    if str(payload.get("deliveryDateCET")) != str(spotdate):
+        problems.append(f"delivery date {payload.get('deliveryDateCET')} is not {spotdate}")
+    entries = payload.get("multiAreaEntries")
+    if not entries:
+        problems.append("no price entries")
+        return problems
+    for entry in entries:
+        prices = entry.get("entryPerArea") or {}
+        missing = [area for area in NORDPOOL_AREAS if not isinstance(prices.get(area), (int, float))]
+        if missing or not entry.get("deliveryStart") or not entry.get("deliveryEnd"):
+            problems.append(f"entry {entry.get('deliveryStart')} lacks a price for {', '.join(missing) or 'its interval'}")
+            return problems
+    if problems:
+        return problems
+    try:
+        series = normalize_spotprices(payload)
+    except ValueError as exc:
+        problems.append(str(exc))
+        return problems
+    # A DST change day has 23 or 25 hours, the count has to match the day's length
+    first = series[0]
+    if not first.is_complete():
+        problems.append(
+            f"{len(first.prices)} intervals of {first.resolution} minutes from {first.start}, "
+            f"expected {first.expected_intervals()} from the start of the day"
+        )
+    return problems
+
+
+def _parse_utc(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def normalize_spotprices(payload: dict, areas: tuple[str, ...] = NORDPOOL_AREAS) -> list[SpotPriceSeries]:
+    """Turn a DayAheadPrices response into one SpotPriceSeries per area."""
+    entries = sorted(payload["multiAreaEntries"], key=lambda entry: entry["deliveryStart"])
+    start = _parse_utc(entries[0]["deliveryStart"])
+    resolution = _parse_utc(entries[0]["deliveryEnd"]) - start
+    for previous, entry in zip(entries, entries[1:]):
+        if _parse_utc(entry["deliveryStart"]) - _parse_utc(previous["deliveryStart"]) != resolution:
+            raise ValueError(f"Spot price intervals are not contiguous at {entry['deliveryStart']}")
+
+    return [
+        SpotPriceSeries(
+            area=area,
+            delivery_date=date.fromisoformat(payload["deliveryDateCET"]),
+            start=start,
+            resolution=int(resolution.total_seconds() // 60),
+            currency=payload.get("currency", "DKK"),
+            prices=[entry["entryPerArea"][area] for entry in entries],
+        )
+        for area in areas
+    ]
+
+
+async def upload_series(token, series: SpotPriceSeries, writer: BackendWriter | BatchWriter | None = None):
+    """Upload the compact spot prices of one area and day."""
+    response = await post("/spotprice/series", series.to_payload(), token, writer)
+    if response is None:
+        _logger.info(f"{series.area} spot prices for {series.delivery_date} queued for bulk upload.")
+    elif response.skipped:
+        _logger.info(f"{series.area} spot prices for {series.delivery_date} unchanged, not sent.")
+    elif response.ok:
+        _logger.info(f"{series.area} spot prices for {series.delivery_date} sent in {response.latency * 1000:.0f} ms.")
+    else:
+        _logger.error(f"Failed to send spot prices: {response.status_code} - {response.text}")
+
 
+async def upload_day(token, payload: dict, writer: BackendWriter | BatchWriter | None = None):
+    """Upload one validated day in the configured format."""
+    if SPOTPRICE_UPLOAD_FORMAT == "raw":
+        await upload(token, payload, writer)
+        return
+    for series in normalize_spotprices(payload):
+        if SPOTPRICE_UPLOAD_RESOLUTION and SPOTPRICE_UPLOAD_RESOLUTION != series.resolution:
+            series = series.resample(SPOTPRICE_UPLOAD_RESOLUTION)
+        await upload_series(token, series, writer)
+
+
+async def fetch_spotprices(dates: list, concurrency: int = SPOTPRICE_CONCURRENCY) -> dict:
+    """Fetch the days concurrently, returns the valid responses by date.
+
+    Days Nord Pool has not published yet (204) or that fail validation are left out.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _fetch(spotdate):
+        async with semaphore:
+            response = await get_nordpool_spotprices(spotdate)
+        if response.status_code != 200:
+            return None
+        payload = response.json()
+        problems = validate_spotprices(payload, spotdate)
+        if problems:
+            _logger.error(f"Invalid spot prices for {spotdate}: {'; '.join(problems)}")
+            return None
+        return payload
+
+    results = await asyncio.gather(*(_fetch(spotdate) for spotdate in dates))
+    return {spotdate: payload for spotdate, payload in zip(dates, results) if payload is not None}
+
+
+async def insert_spotprices_range(dates: list, token, writer: BackendWriter | BatchWriter | None = None) -> int:
+    """Fetch all the days at once and upload them together.
+
+    With a BackendWriter or no writer the days are still sent in one bulk call.
+    Returns the number of days uploaded.
+    """
+    days = await fetch_spotprices(dates)
+    async with AsyncExitStack() as stack:
+        if not isinstance(writer, BatchWriter):
+            if writer is None:
+                writer = await stack.enter_async_context(BackendWriter(token))
+            writer = await stack.enter_async_context(BatchWriter(writer))
+        for spotdate in dates:
+            if spotdate in days:
+                await upload_day(token, days[spotdate], writer)
+    return len(days)
+
+
+async def insert_spotprices(spotdate: datetime, token, writer: BackendWriter | BatchWriter | None = None):
+    _logger.info(f"Processing date: {spotdate}")
+    await insert_spotprices_range([spotdate], token, writer)
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+import hashlib
+import logging
+
+from models import ChargeownerLatestCharge, OwnerSyncState
+from settings import connect_state_db, settings
+
+_logger = logging.getLogger(__name__)
+
+# Where the sync state is kept between runs, e.g. a file under /home on the Functions host
+SYNC_STATE_DB = settings.sync_state_db
+# An open ended owner is probed again after SYNC_STATE_MIN_INTERVAL seconds, the interval
+# doubles every time EDS had nothing new, up to SYNC_STATE_MAX_INTERVAL
+SYNC_STATE_MIN_INTERVAL = settings.sync_state_min_interval
+SYNC_STATE_MAX_INTERVAL = settings.sync_state_max_interval
+
+FUTURE_DATE = datetime(9999, 12, 31, 23, 59, 59)
+
+
+def _as_datetime(value) -> datetime:
+    if value is None:
+        return FUTURE_DATE
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def fingerprint(chargeowner: ChargeownerLatestCharge) -> str:
+    """Hash of the latest period of an owner, equal as long as nothing changed."""
+    text = "|".join((
+        str(chargeowner.glnnumber),
+        str(chargeowner.chargetypecode),
+        _as_datetime(chargeowner.valid_from).isoformat() if chargeowner.valid_from else "",
+        _as_datetime(chargeowner.valid_to).isoformat(),
+    ))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class SyncStateStore:
+    """When each chargeowner was last checked against EDS and when it is worth probing again.
+
+    An owner is skipped while the latest charge in the backend is still the one seen at
+    the last check and its next probe date has not come. Owners with a closed period are
+    probed when it ends, open ended owners on the staleness interval.
+    """
+
+    def __init__(self, path: str = SYNC_STATE_DB, min_interval: float = SYNC_STATE_MIN_INTERVAL,
+                 max_interval: float = SYNC_STATE_MAX_INTERVAL) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._db = connect_state_db(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS owner_sync_state ("
+            " owner_id INTEGER PRIMARY KEY, last_checked TEXT NOT NULL, fingerprint TEXT NOT NULL,"
+            " next_probe TEXT NOT NULL, interval REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, owner_id: int) -> OwnerSyncState | None:
+        row = self._db.execute(
+            "SELECT owner_id, last_checked, fingerprint, next_probe, interval"
+            " FROM owner_sync_state WHERE owner_id = ?",
+            (owner_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return OwnerSyncState(row[0], datetime.fromisoformat(row[1]), row[2], datetime.fromisoformat(row[3]), row[4])
+
+    def should_probe(self, chargeowner: ChargeownerLatestCharge, now: datetime | None = None) -> bool:
+        """False when the owner was checked recently and nothing changed in the backend since."""
+        if not chargeowner.valid_from:
+            return True
+        state = self.get(chargeowner.id)
+        if state is None or state.fingerprint != fingerprint(chargeowner):
+            return True
+        return (now or datetime.now()) >= state.next_probe
+
+    def record(self, chargeowner: ChargeownerLatestCharge, now: datetime | None = None) -> OwnerSyncState:
+        """Store the state of an owner right after it was synced."""
+        now = now or datetime.now()
+        previous = self.get(chargeowner.id)
+        current = fingerprint(chargeowner)
+        valid_to = _as_datetime(chargeowner.valid_to)
+
+        if previous is not None and previous.fingerprint == current:
+            interval = min(previous.interval * 2, self.max_interval)
+        else:
+            interval = self.min_interval
+
+        if valid_to != FUTURE_DATE and valid_to > now:
+            # Nothing to fetch before the current period ends
+            next_probe = valid_to
+        else:
+            next_probe = now + timedelta(seconds=interval)
+
+        state = OwnerSyncState(chargeowner.id, now, current, next_probe, interval)
+        self._db.execute(
+            "INSERT OR REPLACE INTO owner_sync_state (owner_id, last_checked, fingerprint, next_probe, interval)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (state.owner_id, state.last_checked.isoformat(), state.fingerprint, state.next_probe.isoformat(), state.interval),
+        )
+        self._db.commit()
+        _logger.debug(f"Next probe of chargeowner {chargeowner.id} at {next_probe}")
+        return state
+
+    def forget(self, owner_id: int) -> None:
+        self._db.execute("DELETE FROM owner_sync_state WHERE owner_id = ?", (owner_id,))
+        self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
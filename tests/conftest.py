@@ -0,0 +1,18 @@
+import os
+import sys
+
+# The modules live at the top of the repository, next to function_app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("BASE_URL", "http://localhost")
+
+import pytest
+
+from eds_cache import response_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """sync_chargeowners uses the shared EDS cache, a test must not see the responses of another."""
+    response_cache.clear()
+    yield
+    response_cache.clear()
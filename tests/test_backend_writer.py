@@ -0,0 +1,30 @@
+import asyncio
+
+import httpx
+
+import backend_writer
+from backend_writer import BackendWriter, BatchWriter
+from fake_backend import TOKEN, FakeBackend
+
+TAX = {"valid_from": "2025-01-01T00:00:00", "valid_to": "2025-07-01T00:00:00", "taxammount": 0.72}
+
+
+def test_missing_bulk_endpoint_is_probed_once_and_not_a_failure(monkeypatch):
+    with FakeBackend(bulk=False) as backend:
+        monkeypatch.setattr(backend_writer, "BASE_URL", backend.url)
+
+        async def run():
+            async with httpx.AsyncClient() as client:
+                writer = BackendWriter(TOKEN, client)
+                # One batch per partition, like the backfill
+                for _ in range(3):
+                    async with BatchWriter(writer) as batch:
+                        batch.add("/tax", TAX)
+                return writer
+
+        writer = asyncio.run(run())
+
+    bulk_requests = [path for _, path in backend.requests if path.endswith("/bulk")]
+    assert bulk_requests == ["/tax/bulk"]
+    assert len(backend.records["/tax"]) == 3
+    assert writer.failed == 0
@@ -0,0 +1,42 @@
+import asyncio
+
+import httpx
+import pytest
+
+from connector import Connector
+from eds_cache import ResponseCache
+from models import ChargeownerLatestCharge
+from rate_limit import RateLimiter, StatusError
+
+CHARGEOWNER = ChargeownerLatestCharge(1, "Net A/S", "['D03']", "C1", "5790000000001")
+
+
+def get_pricelist(handler) -> list[dict]:
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            connector = Connector(client, CHARGEOWNER, page_size=2, cache=ResponseCache(),
+                                  limiter=RateLimiter("test", 1000, 1, 1000))
+            return await connector.async_get_pricelist(CHARGEOWNER, CHARGEOWNER.chargetypecode)
+
+    return asyncio.run(run())
+
+
+def test_pages_are_read_until_a_short_page():
+    records = [{"ValidFrom": f"202{year}-01-01T00:00:00", "ValidTo": None} for year in range(5)]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        offset, limit = int(request.url.params["offset"]), int(request.url.params["limit"])
+        return httpx.Response(200, json={"records": records[offset:offset + limit]})
+
+    assert get_pricelist(handler) == records
+
+
+def test_client_error_on_a_later_page_is_raised_not_truncated():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params["offset"] == "0":
+            return httpx.Response(200, json={"records": [{"ValidFrom": "2020-01-01T00:00:00"}] * 2})
+        return httpx.Response(400, json={"error": "bad request"})
+
+    with pytest.raises(StatusError) as raised:
+        get_pricelist(handler)
+    assert raised.value.status_code == 400
@@ -0,0 +1,26 @@
+import time
+
+from eds_cache import CacheEntry, ResponseCache
+
+
+def entry(records: int) -> CacheEntry:
+    return CacheEntry([{"Price1": 1.0}] * records, time.time())
+
+
+def test_memory_is_bounded_by_records():
+    cache = ResponseCache(max_entries=100, max_records=10, max_page_records=10)
+    for key in "abc":
+        cache.put(key, entry(4))
+
+    assert cache.get("a") is None
+    assert cache.get("b") is not None and cache.get("c") is not None
+    assert cache.stats()["records"] == 8
+
+
+def test_pages_over_the_limit_are_not_cached():
+    cache = ResponseCache(max_page_records=5)
+    cache.put("large", entry(6))
+    cache.put("small", entry(5))
+
+    assert cache.get("large") is None
+    assert cache.get("small") is not None
@@ -0,0 +1,36 @@
+from datetime import date, timedelta
+
+from interval_index import IntervalIndex
+
+
+def entry(name: str, valid_from: date, valid_to: date | None) -> dict:
+    return {"Note": name, "ValidFrom": f"{valid_from.isoformat()}T00:00:00",
+            "ValidTo": f"{valid_to.isoformat()}T00:00:00" if valid_to else None}
+
+
+def scan(entries: list[dict], day: date) -> list[dict]:
+    day = day.isoformat()
+    return [entry for entry in sorted(entries, key=lambda entry: entry["ValidFrom"][:10])
+            if entry["ValidFrom"][:10] <= day and (entry["ValidTo"] is None or entry["ValidTo"][:10] > day)]
+
+
+def test_covering_matches_a_full_scan_with_an_old_open_ended_entry():
+    start = date(2020, 1, 1)
+    entries = [entry("Elafgift", date(2019, 12, 1), None)]
+    entries += [entry(f"Nettarif {month}", start + timedelta(days=30 * month), start + timedelta(days=30 * (month + 1)))
+                for month in range(48)]
+    entries.append(entry("Systemtarif", start + timedelta(days=400), None))
+    index = IntervalIndex(reversed(entries))
+
+    for offset in range(-40, 30 * 50, 7):
+        day = start + timedelta(days=offset)
+        assert index.covering(day) == scan(entries, day)
+    assert len(index) == len(entries)
+
+
+def test_overlapping_includes_open_ended_entries_started_before_the_end():
+    entries = [entry("A", date(2024, 1, 1), date(2024, 2, 1)), entry("B", date(2024, 3, 1), None)]
+    index = IntervalIndex(entries)
+
+    assert index.overlapping(date(2024, 1, 15), date(2024, 3, 1)) == entries[:1]
+    assert index.overlapping(date(2024, 1, 15), date(2024, 3, 2)) == entries
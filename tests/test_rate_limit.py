@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from rate_limit import RateLimiter, RetryBudget, RetryError
+
+
+def throttled(retry_after: str):
+    calls = []
+
+    async def send() -> httpx.Response:
+        calls.append(time.monotonic())
+        return httpx.Response(429, headers={"Retry-After": retry_after})
+
+    return calls, send
+
+
+def test_long_retry_after_fails_at_once_and_pauses_at_most_max_delay():
+    limiter = RateLimiter("test", rate=100, min_rate=1, max_rate=100, max_delay=2)
+    calls, send = throttled("3600")
+
+    started = time.monotonic()
+    with pytest.raises(RetryError):
+        asyncio.run(limiter.call(send))
+
+    assert len(calls) == 1
+    assert time.monotonic() - started < 1
+    assert limiter._paused_until - time.monotonic() <= 2
+
+
+def test_exhausted_budget_fails_without_waiting():
+    limiter = RateLimiter("test", rate=100, min_rate=1, max_rate=100, max_delay=2, budget=RetryBudget(size=0))
+    calls, send = throttled("1")
+
+    started = time.monotonic()
+    with pytest.raises(RetryError):
+        asyncio.run(limiter.call(send))
+
+    assert len(calls) == 1
+    assert time.monotonic() - started < 0.5
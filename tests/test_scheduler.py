@@ -0,0 +1,48 @@
+import asyncio
+
+from scheduler import Scheduler, WorkUnit
+
+
+def run(scheduler: Scheduler, units: list[WorkUnit]):
+    events = []
+    report = asyncio.run(scheduler.run(units, lambda name, status, seconds: events.append((name, status, seconds))))
+    return report, events
+
+
+def test_failing_unit_is_reported_and_the_run_goes_on(tmp_path):
+    async def fail():
+        raise RuntimeError("boom")
+
+    async def ok():
+        return 1
+
+    scheduler = Scheduler(budget=60, margin=0, path=str(tmp_path / "scheduler.sqlite"))
+    report, events = run(scheduler, [WorkUnit("a", "test", fail, priority=0), WorkUnit("b", "test", ok, priority=1)])
+    scheduler.close()
+
+    assert report.failed == {"a": "RuntimeError('boom')"}
+    assert report.completed == ["b"]
+    assert report.results == {"b": 1}
+    assert set(report.timings) == {"a", "b"}
+    assert [(name, status) for name, status, _ in events] == [
+        ("a", "running"), ("a", "failed"), ("b", "running"), ("b", "done")]
+    assert events[1][2] is not None
+
+
+def test_unit_over_the_deadline_is_stopped_and_kept_as_backlog(tmp_path):
+    async def slow():
+        await asyncio.sleep(10)
+
+    path = str(tmp_path / "scheduler.sqlite")
+    scheduler = Scheduler(budget=0.2, margin=0, path=path)
+    report, events = run(scheduler, [WorkUnit("slow", "test", slow)])
+    scheduler.close()
+
+    assert report.backlog == ["slow"]
+    assert report.completed == []
+    assert events[-1][:2] == ("slow", "stopped")
+    assert 0 < events[-1][2] < 5
+
+    scheduler = Scheduler(budget=60, margin=0, path=path)
+    assert scheduler._db.execute("SELECT name FROM backlog").fetchall() == [("slow",)]
+    scheduler.close()
@@ -0,0 +1,23 @@
+from settings import connect_state_db
+
+
+def test_state_db_is_created_with_its_directory(tmp_path):
+    path = tmp_path / "state" / "jobs.sqlite"
+    db = connect_state_db(str(path))
+    db.execute("CREATE TABLE job (id TEXT)")
+    db.commit()
+    db.close()
+
+    assert path.exists()
+
+
+def test_state_db_falls_back_to_memory_when_it_cannot_be_written(tmp_path):
+    blocker = tmp_path / "not_a_directory"
+    blocker.write_text("")
+
+    db = connect_state_db(str(blocker / "jobs.sqlite"))
+    db.execute("CREATE TABLE job (id TEXT)")
+    db.execute("INSERT INTO job VALUES ('a')")
+
+    assert db.execute("SELECT id FROM job").fetchall() == [("a",)]
+    assert db.execute("PRAGMA database_list").fetchone()[2] == ""
@@ -0,0 +1,140 @@
+import asyncio
+
+import httpx
+import pytest
+
+import app_main
+from connector import Connector
+from eds_cache import ResponseCache
+from models import ChargeownerLatestCharge
+from sync_state import SyncStateStore
+
+
+def record(valid_from: str, valid_to: str | None, price: float) -> dict:
+    entry = {"ChargeOwner": "Net A/S", "GLN_Number": "5790000000001", "ChargeType": "D03", "ChargeTypeCode": "C1",
+             "Note": "Nettarif", "Description": "Nettarif C", "ValidFrom": valid_from, "ValidTo": valid_to,
+             "VATClass": "D02", "TransparentInvoicing": 0, "TaxIndicator": 0, "ResolutionDuration": "PT1H"}
+    entry.update({f"Price{hour}": price for hour in range(1, 25)})
+    return entry
+
+
+HISTORY = [record("2024-01-01T00:00:00", "2025-01-01T00:00:00", 1.0),
+           record("2025-01-01T00:00:00", None, 2.0)]
+
+
+def sync(monkeypatch, valid_from: str | None, valid_to: str | None, records: list[dict] = HISTORY):
+    def handler(request: httpx.Request) -> httpx.Response:
+        offset, limit = int(request.url.params["offset"]), int(request.url.params["limit"])
+        return httpx.Response(200, json={"records": records[offset:offset + limit]})
+
+    inserted = []
+
+    async def insert_charge(charge, chargeowner, token, writer=None):
+        inserted.append(charge["tariffs"]["ValidFrom"])
+
+    monkeypatch.setattr(app_main, "insert_charge", insert_charge)
+    chargeowner = ChargeownerLatestCharge(1, "Net A/S", "['D03']", "C1", "5790000000001", valid_from, valid_to)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            connector = Connector(client, chargeowner, cache=ResponseCache())
+            return await app_main.sync_chargeowner(connector, chargeowner, "token")
+
+    return asyncio.run(run()), inserted, chargeowner
+
+
+@pytest.mark.parametrize("valid_from, valid_to", [
+    ("2024-01-01T00:00:00", "9999-12-31T23:59:59"),  # Stored open ended, since closed by a newer period
+    ("2024-01-01T00:00:00", "2025-01-01T00:00:00"),  # Stored closed period
+])
+def test_newer_period_is_inserted(monkeypatch, valid_from, valid_to):
+    count, inserted, chargeowner = sync(monkeypatch, valid_from, valid_to)
+
+    assert count == 1
+    assert inserted == ["2025-01-01T00:00:00"]
+    assert chargeowner.valid_to == "9999-12-31T23:59:59"
+
+
+def test_current_open_period_is_not_inserted_again(monkeypatch):
+    count, inserted, _ = sync(monkeypatch, "2025-01-01T00:00:00", "9999-12-31T23:59:59")
+
+    assert count == 0
+    assert inserted == []
+
+
+def test_new_owner_without_eds_data_is_skipped_not_failed(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        offset, limit = int(request.url.params["offset"]), int(request.url.params["limit"])
+        return httpx.Response(200, json={"records": HISTORY[offset:offset + limit]})
+
+    inserted = []
+
+    async def insert_charge(charge, chargeowner, token, writer=None):
+        inserted.append((chargeowner.glnnumber, charge["tariffs"]["ValidFrom"]))
+
+    monkeypatch.setattr(app_main, "insert_charge", insert_charge)
+    chargeowners = [ChargeownerLatestCharge(1, "Net A/S", "['D03']", "C1", "5790000000001"),
+                    ChargeownerLatestCharge(2, "Ny Net A/S", "['D03']", "C1", "5790000000002")]
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await app_main.sync_chargeowners(client, chargeowners, "token")
+
+    summary = asyncio.run(run())
+
+    assert summary.synced == [1]
+    assert summary.skipped == [2]
+    assert summary.failed == {}
+    assert inserted == [("5790000000001", "2024-01-01T00:00:00"), ("5790000000001", "2025-01-01T00:00:00")]
+
+
+def test_failed_eds_request_is_not_recorded_as_synced(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(400, json={"error": "bad filter"})
+
+    chargeowner = ChargeownerLatestCharge(1, "Net A/S", "['D03']", "C1", "5790000000001",
+                                          "2024-01-01T00:00:00", "2025-01-01T00:00:00")
+    state = SyncStateStore(":memory:")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await app_main.sync_chargeowners(client, [chargeowner], "token", state=state)
+
+    summary = asyncio.run(run())
+
+    assert summary.synced == []
+    assert 1 in summary.failed
+    assert state.should_probe(chargeowner)
+
+
+def test_due_owners_share_one_bulk_query_and_a_malformed_owner_fails_alone(monkeypatch):
+    other = [dict(entry, GLN_Number="5790000000002") for entry in HISTORY]
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        offset, limit = int(request.url.params["offset"]), int(request.url.params["limit"])
+        return httpx.Response(200, json={"records": (HISTORY + other)[offset:offset + limit]})
+
+    inserted = []
+
+    async def insert_charge(charge, chargeowner, token, writer=None):
+        inserted.append((chargeowner.glnnumber, charge["tariffs"]["ValidFrom"]))
+
+    monkeypatch.setattr(app_main, "insert_charge", insert_charge)
+    chargeowners = [
+        ChargeownerLatestCharge(1, "Net A/S", "['D03']", "C1", "5790000000001", "2024-01-01T00:00:00", "2025-01-01T00:00:00"),
+        ChargeownerLatestCharge(2, "Ny Net A/S", "['D03']", "C1", "5790000000002", "2024-01-01T00:00:00", "2025-01-01T00:00:00"),
+        ChargeownerLatestCharge(3, "Net A/S", "[D03", "C2", "5790000000001", "2024-01-01T00:00:00", "2025-01-01T00:00:00"),
+    ]
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await app_main.sync_chargeowners(client, chargeowners, "token")
+
+    summary = asyncio.run(run())
+
+    assert len(requests) == 1
+    assert sorted(summary.synced) == [1, 2]
+    assert list(summary.failed) == [3]
+    assert sorted(inserted) == [("5790000000001", "2025-01-01T00:00:00"), ("5790000000002", "2025-01-01T00:00:00")]